@@ -56,6 +56,9 @@ def generate_experiment(domain_dir, domain, **kwargs):
         # Number of states to be expanded in the sampling procedure
         num_states=50,
 
+        # Number of worker processes used to sample the training instances in parallel (default: 1)
+        num_sampling_workers=1,
+
         # Number randomly sampled states among the set of expanded states. The default of None means
         # all expanded states will be used
         num_sampled_states=None,
@@ -102,6 +105,23 @@ def generate_experiment(domain_dir, domain, **kwargs):
         # The M parameter of the LP formulation (?)
         lp_max_weight=10,
 
+        # The solver used to learn the weights of the heuristic. Accepted options are:
+        # - "cplex" (default)
+        # - "highs": the open-source HiGHS solver (requires the highspy package)
+        # - "lp" or "mps": don't solve the MIP, only write it in the given format, to be solved externally
+        mip_solver="cplex",
+
+        # Whether to leave out of the MIP the features that are constant over the sample, and those that are an affine
+        # function of some feature of lower complexity, whose max. weight is scaled accordingly. The optimal complexity
+        # can then be lower than without pruning, with weights above lp_max_weight (default: False)
+        prune_redundant_features=False,
+
+        # Whether to solve the MIP with lazy constraints: starting with the constraints of lp_lazy_initial_states
+        # states only, and adding those of the states in which the solution is not descending or not dead-end-avoiding
+        # until there are none. Only with a MIP solver (default: False)
+        lp_lazy_constraints=False,
+        lp_lazy_initial_states=100,
+
         domain_dir=domain_dir,
 
         # The selection strategy to be used when marking which transitions are considered as optimal.
@@ -116,6 +136,9 @@ def generate_experiment(domain_dir, domain, **kwargs):
         # The max. number of states in the Flaw set when validating an incremental abstraction
         batch_refinement_size=10,
 
+        # Number of worker processes used to compute the feature denotations when looking for flaws (default: 1)
+        num_validation_workers=1,
+
         # Whether to clean the (sub-) workspaces used to compute incremental abstractions after finishing.
         clean_workspace=True,
 
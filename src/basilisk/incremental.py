@@ -1,13 +1,17 @@
 import itertools
 import logging
+import multiprocessing
 import os
 import shutil
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from basilisk.common import is_alive, has_improving_successor
-from basilisk.runner import ConceptBasedPotentialHeuristic
-from basilisk.steps import PyperplanStep, HeuristicWeightsLPComputation, HeuristicTestingComputation
+from basilisk.common import is_alive
+from basilisk.mip import BACKENDS
+from basilisk.runner import ConceptBasedPotentialHeuristic, WeightMIP, learn_weights
+from basilisk.steps import PyperplanStep, HeuristicWeightsLPComputation, HeuristicTestingComputation, \
+    process_weight_learning_config
 from sltp.driver import Experiment, generate_pipeline_from_list, check_int_parameter, InvalidConfigParameter, load, \
     TransitionSamplingStep, run_and_check_output, SubprocessStepRunner, Bunch, save, ConceptGenerationStep, \
     FeatureMatrixGenerationStep
@@ -49,40 +53,49 @@ def full_learning(config, sample, rng):
 
     # Note that the validator will validate wrt the full sample
     _, model_cache = create_model_cache_from_samples(vocabulary, sample, config.domain, config.parameter_generator, infos)
-    validator = KnowledgeValidator(model_cache, sample, expanded_state_ids_shuffled)
+    validator = KnowledgeValidator(model_cache, sample, expanded_state_ids_shuffled, config.num_validation_workers)
+
+    # The MIP is kept alive across iterations, so that each refinement only adds the constraints of the new states
+    weight_model = WeightMIP(config.mip_solver, config.lp_max_weight)
 
     k, k_max, k_step = config.initial_concept_bound, config.max_concept_bound, config.concept_bound_step
     assert k <= k_max
-    while True:
-        print("Working sample idxs: {}".format(sorted(working_sample_idxs)))
-        print("Working sample: {}".format(working_sample.info()))
-        print("States in Working sample: {}".format(sorted(working_sample.remapping.keys())))
-        res, k, abstraction = try_to_compute_heuristic_in_range(config, working_sample, k, k_max, k_step)
-        if res == ExitCode.NoAbstractionUnderComplexityBound:
-            logging.error("No abstraction possible for given sample set under max. complexity {}".format(k_max))
-            return res, dict()
-
-        # Otherwise, we learnt an abstraction with max. complexity k. Let's refine the working sample set with it!
-        logging.info("Abstraction with k={} found for sample set of size {} ".format(k, working_sample.num_states()))
-
-        # Look for flaws in the full sample set
-        flaws = validator.find_flaws(abstraction, config.batch_refinement_size)
-        if not flaws:
-            break
-        logging.info("{} flaws found in the computed abstraction: {}".format(len(flaws), sorted(flaws)))
-
-        # Augment the sample set with the flaws found for the current abstraction
-        working_sample_idxs.update(flaws)
-        working_sample = sample.resample(working_sample_idxs)  # This will "close" the sample set with children states
+    try:
+        while True:
+            print("Working sample idxs: {}".format(sorted(working_sample_idxs)))
+            print("Working sample: {}".format(working_sample.info()))
+            print("States in Working sample: {}".format(sorted(working_sample.remapping.keys())))
+            res, k, abstraction = try_to_compute_heuristic_in_range(config, working_sample, k, k_max, k_step,
+                                                                    weight_model)
+            if res == ExitCode.NoAbstractionUnderComplexityBound:
+                logging.error("No abstraction possible for given sample set under max. complexity {}".format(k_max))
+                return res, dict()
+
+            # Otherwise, we learnt an abstraction with max. complexity k. Let's refine the working sample set with it!
+            logging.info("Abstraction with k={} found for sample set of size {} ".format(
+                k, working_sample.num_states()))
+
+            # Look for flaws in the full sample set
+            flaws = validator.find_flaws(abstraction, config.batch_refinement_size)
+            if not flaws:
+                break
+            logging.info("{} flaws found in the computed abstraction: {}".format(len(flaws), sorted(flaws)))
+
+            # Augment the sample set with the flaws found for the current abstraction
+            working_sample_idxs.update(flaws)
+            # This will "close" the sample set with children states
+            working_sample = sample.resample(working_sample_idxs)
+    finally:
+        validator.close()  # Shut down the worker processes of the flaw search, if any
 
     logging.info("The computed abstraction is sound & complete wrt all of the training instances")
     return ExitCode.Success, abstraction
 
 
-def try_to_compute_heuristic_in_range(config, sample, k_0, k_max, k_step):
+def try_to_compute_heuristic_in_range(config, sample, k_0, k_max, k_step, weight_model):
     k, abstraction = k_0, None  # To avoid referenced-before-assigned warnings
     for k in range(k_0, k_max + 1, k_step):
-        exitcode, abstraction = try_to_compute_heuristic(config, sample, k)
+        exitcode, abstraction = try_to_compute_heuristic(config, sample, k, weight_model)
         if exitcode == ExitCode.Success:
             return exitcode, k, abstraction
         else:
@@ -112,7 +125,16 @@ def teardown_workspace(experiment_dir, clean_workspace, **kwargs):
     return data
 
 
-def try_to_compute_heuristic(config, sample, k):
+def compute_weights(config, weight_model):
+    """ Run the computation of the weights of the heuristic within the current process, on the given WeightMIP """
+    data = load(config["experiment_dir"], ["features"])
+    exitcode, output = learn_weights(Bunch(config), Bunch(data), weight_model)
+    if exitcode == ExitCode.Success:
+        save(config["experiment_dir"], output)
+    return exitcode
+
+
+def try_to_compute_heuristic(config, sample, k, weight_model):
     """ Try to learn a generalized potential heursitic for the given sample,
     with max. concept complexity given by k
     """
@@ -124,59 +146,208 @@ def try_to_compute_heuristic(config, sample, k):
         HeuristicWeightsLPComputation],
         **subconfig)
 
-    for step in steps:
+    # The concepts and the feature matrix depend on the sample, and are computed anew in subprocesses. The MIP
+    # instead is solved within this process, extending the model of the previous iterations.
+    for step in steps[:-1]:
         exitcode = run_and_check_output(step, SubprocessStepRunner, raise_on_error=False)
         if exitcode != ExitCode.Success:
             return exitcode, None
 
+    exitcode = compute_weights(subconfig, weight_model)
+    if exitcode != ExitCode.Success:
+        return exitcode, None
+
     # All steps successfully executed, ergo we found an abstraction.
     data = teardown_workspace(**subconfig)
     return ExitCode.Success, data
 
 
+# The number of states checked in the first chunk of the flaw search, which doubles for each following chunk
+_INITIAL_CHUNK_SIZE = 64
+
+# The feature models of the states of the validator in each worker process of the flaw search
+_worker_models = None
+
+
+def _initialize_worker(model_cache, states):
+    global _worker_models
+    _worker_models = FeatureModels(model_cache, states)
+
+
+def _compute_denotations(features, states, missing):
+    return _worker_models.compute_denotations(features, states, missing)
+
+
+def select_first_flaws(positions, flaws, max_flaws):
+    """ Return the set of flaws found when checking states in order until at least max_flaws are found, given the
+    position in that order of the check that finds each flaw """
+    order = np.argsort(positions, kind="stable")
+    positions, flaws = positions[order], flaws[order]
+    flaws, first = np.unique(flaws, return_index=True)
+    found_at = positions[first]
+    if len(flaws) > max_flaws:
+        flaws = flaws[found_at <= np.sort(found_at)[max_flaws - 1]]
+    return set(flaws.tolist())
+
+
+class FeatureModels:
+    """ The feature models of the given states, which are built when first needed """
+    def __init__(self, model_cache, states):
+        self.model_cache = model_cache
+        self.states = states
+        self.models = [None] * len(states)
+
+    def model(self, i):
+        if self.models[i] is None:
+            self.models[i] = self.model_cache.get_feature_model(self.states[i])
+        return self.models[i]
+
+    def compute_denotations(self, features, states, missing):
+        """ Return the matrix with the denotation of each of the given features (rows) in each of the states with
+        the given indices (columns), computed only where the given boolean matrix is true, and -1 elsewhere """
+        values = np.full((len(features), len(states)), -1, dtype=np.int64)
+        for j, i in enumerate(states.tolist()):
+            for k in np.flatnonzero(missing[:, j]).tolist():
+                values[k, j] = int(self.model(i).denotation(features[k]))
+        return values
+
+
 class KnowledgeValidator:
-    def __init__(self, model_cache, sample, state_ids):
-        """ """
+    def __init__(self, model_cache, sample, state_ids, num_workers=1):
+        """ The flaws are searched over the given state ids, in order. With num_workers > 1, the denotations of the
+        features are computed in a pool of that many worker processes, which is started when first needed and
+        lives until `close` is called. The workers are not forked from this process, which might hold the threads
+        of a MIP solver, so the model cache needs to be picklable. """
         self.model_cache = model_cache
+        self.num_workers = num_workers
         self.sample = sample
         self.state_ids = state_ids
+        assert all(s in sample.expanded for s in self.state_ids)  # state_ids assumed to contain only expanded states.
+
+        # The states whose heuristic value is needed to check the states in state_ids, starting with these, and the
+        # checks over their indices. The index of each state in state_ids is also its position there.
+        self.states = list(state_ids)
+        index = {s: i for i, s in enumerate(self.states)}
+
+        def state_index(s):
+            if s not in index:
+                index[s] = len(self.states)
+                self.states.append(s)
+            return index[s]
+
+        # Each alive state needs some successor with lower heuristic value
+        alive = [k for k, s in enumerate(state_ids) if is_alive(s, sample)]
+        successors = [[state_index(t) for t in sample.transitions[state_ids[k]]] for k in alive]
+        self.alive = np.array(alive, dtype=np.int64)
+        self.successor_indptr = np.concatenate(([0], np.cumsum([len(ts) for ts in successors]))).astype(np.int64)
+        self.successors = np.array([t for ts in successors for t in ts], dtype=np.int64)
+
+        # Any transition from a solvable to an unsolvable states needs to provoke an increase in the heuristic value
+        dead_ends = [(k, state_index(p), index[s]) for k, s in enumerate(state_ids)
+                     if s in sample.unsolvable and s in sample.parents
+                     for p in sample.parents[s] if p not in sample.unsolvable]
+        self.dead_end_positions, self.dead_end_parents, self.dead_end_states = \
+            (np.array(column, dtype=np.int64) for column in zip(*dead_ends)) if dead_ends else \
+            (np.zeros(0, dtype=np.int64) for _ in range(3))
+        self.feature_models = FeatureModels(model_cache, self.states)
+        self.executor = None
+
+        # The denotation of each feature seen so far in each state of self.states, -1 where it has not been computed.
+        # Features only depend on the state, so these are shared by the heuristics of all iterations, which tend to
+        # reuse many features.
+        self.denotations = dict()
+
+    def get_executor(self):
+        """ Return the pool of worker processes, starting it if needed. Each worker keeps the models that it builds
+        for all the following tasks. """
+        if self.executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self.executor = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=context,
+                                                initializer=_initialize_worker,
+                                                initargs=(self.model_cache, self.states))
+        return self.executor
+
+    def close(self):
+        """ Shut down the pool of worker processes, if it was started """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def update_denotations(self, features, states):
+        """ Compute the denotations of the given features that are missing in the states with the given indices,
+        split in one task per worker, each with all features over a chunk of the states """
+        columns = [self.denotations.setdefault(f, np.full(len(self.states), -1, dtype=np.int64)) for f in features]
+        missing = np.array([column[states] < 0 for column in columns], dtype=bool).reshape(len(features), len(states))
+        needed = missing.any(axis=0)
+        states, missing = states[needed], missing[:, needed]
+        if len(states) == 0:
+            return
+
+        if self.num_workers == 1 or len(states) < self.num_workers:
+            values = self.feature_models.compute_denotations(features, states, missing)
+        else:
+            chunks = np.array_split(np.arange(len(states)), self.num_workers)
+            results = self.get_executor().map(_compute_denotations, [features] * len(chunks),
+                                              [states[chunk] for chunk in chunks],
+                                              [missing[:, chunk] for chunk in chunks])
+            values = np.concatenate(list(results), axis=1)
+        for column, row_missing, row_values in zip(columns, missing, values):
+            column[states[row_missing]] = row_values[row_missing]
 
     def find_flaws(self, abstraction, max_flaws):
-        """ We iterate over all the states in the *full* training sample, and check whether the learnt heuristic
-        is descending and dead-end-avoiding at each state s in the sample. If it is not, then we add s to the set
-        of flaws.
+        """ We check whether the learnt heuristic is descending and dead-end-avoiding at each state s in the *full*
+        training sample. If it is not, then we add s to the set of flaws.
+        States are checked in order, in chunks of growing size, until at least max_flaws flaws are found. For each
+        chunk, the heuristic is evaluated over the states involved, from the (cached) denotations of its features,
+        and the checks are array comparisons over the transitions. The flaws are hence the same ones that checking
+        the states one by one would find, regardless of the number of workers.
          """
-        sample = self.sample
-        flaws = set()
         heuristic = abstraction["learned_heuristic"]
         assert isinstance(heuristic, ConceptBasedPotentialHeuristic)
-
         logging.info("Looking for flaws in heuristic:\n{}".format(heuristic))
 
-        assert all(s in sample.expanded for s in self.state_ids)  # state_ids assumed to contain only expanded states.
-        for sid in self.state_ids:
-            model = self.model_cache.get_feature_model(sid)
-            h_s = heuristic.value(model)
-
-            # Check heuristic is descending in the current state
-            if is_alive(sid, sample) and not has_improving_successor(sid, h_s, self.sample, self.model_cache, heuristic):
-                flaws.add(sid)
-
-            if sid in sample.unsolvable:
-                if not sid in sample.parents:
-                    continue
-                for p in sample.parents[sid]:
-                    # Any transition from a solvable to an unsolvable states needs to
-                    # provoke an increase in the heuristic value
-                    if p not in sample.unsolvable:
-                        h_p = heuristic.value(self.model_cache.get_feature_model(p))
-                        if h_s < h_p:
-                            flaws.add(p)
-
-            if len(flaws) >= max_flaws:
+        features = [feature for feature, _ in heuristic.parameters]
+        h = np.zeros(len(self.states))
+        evaluated = np.zeros(len(self.states), dtype=bool)
+        positions, flaws = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        start, size = 0, _INITIAL_CHUNK_SIZE
+        while start < len(self.state_ids):
+            end = min(start + size, len(self.state_ids))
+            first_alive, last_alive = np.searchsorted(self.alive, [start, end])
+            first_dead_end, last_dead_end = np.searchsorted(self.dead_end_positions, [start, end])
+            alive = self.alive[first_alive:last_alive]
+            successor_indptr = self.successor_indptr[first_alive:last_alive + 1]
+            successors = self.successors[successor_indptr[0]:successor_indptr[-1]]
+            dead_end_parents = self.dead_end_parents[first_dead_end:last_dead_end]
+            dead_end_states = self.dead_end_states[first_dead_end:last_dead_end]
+
+            # Evaluate the heuristic in the states of the chunk that haven't been evaluated yet
+            states = np.unique(np.concatenate((alive, successors, dead_end_parents, dead_end_states)))
+            states = states[~evaluated[states]]
+            self.update_denotations(features, states)
+            h[states] = heuristic.evaluate(np.array([self.denotations[f][states] for f in features],
+                                                    dtype=np.int64).reshape(len(features), len(states)).T)
+            evaluated[states] = True
+
+            # Alive states without an improving successor (in particular, those without successors)
+            rows = np.repeat(np.arange(len(alive)), np.diff(successor_indptr))
+            improving = h[successors] < h[alive[rows]]
+            has_improving = np.bincount(rows[improving], minlength=len(alive)) > 0
+            positions.append(alive[~has_improving])
+            flaws.append(alive[~has_improving])
+
+            # Solvable parents with higher heuristic value than their unsolvable children
+            increasing = h[dead_end_states] < h[dead_end_parents]
+            positions.append(self.dead_end_positions[first_dead_end:last_dead_end][increasing])
+            flaws.append(dead_end_parents[increasing])
+
+            if len(np.unique(np.concatenate(flaws))) >= max_flaws:
                 break
+            start, size = end, 2 * size
 
-        return flaws
+        flaws = select_first_flaws(np.concatenate(positions), np.concatenate(flaws), max_flaws)
+        return set(self.states[i] for i in flaws)
 
 
 class IncrementalLearner:
@@ -194,6 +365,13 @@ class IncrementalLearner:
         check_int_parameter(config, "initial_concept_bound")
         check_int_parameter(config, "concept_bound_step")
         check_int_parameter(config, "max_concept_bound")
+        config["num_validation_workers"] = config.get("num_validation_workers", 1)
+        check_int_parameter(config, "num_validation_workers", positive=True)
+        # Each iteration needs the weights learnt in the previous one, so the MIP needs to be solved in-process
+        process_weight_learning_config(config)
+        if not BACKENDS[config["mip_solver"]].can_solve:
+            raise InvalidConfigParameter('"mip_solver" must be a backend that can solve the MIP, not "{}"'.
+                                         format(config["mip_solver"]))
 
         if config["initial_concept_bound"] > config["max_concept_bound"]:
             raise InvalidConfigParameter("initial_config_bound ({}) must be <= than max_concept_bound ({})".
@@ -0,0 +1,383 @@
+""" Solver-independent interface to build and solve the (minimization) MIPs of the weight-learning step.
+
+Models are built incrementally through a MIPBackend: variables are referred to by the integer indices returned by
+add_variables, and constraints are given in bulk as CSR matrices (indptr, variable indices, coefficients) over these
+indices. Infinite bounds are given as math.inf. Indicator constraints are native in CPLEX, and reformulated with big-M
+constraints for the other backends, which requires all variables in them to be bounded.
+"""
+import logging
+import math
+
+import numpy as np
+
+BINARY, CONTINUOUS, INTEGER = 'B', 'C', 'I'
+
+OPTIMAL, UNBOUNDED, INFEASIBLE, UNKNOWN = "optimal", "unbounded", "infeasible", "unknown"
+
+
+class MIPBackend:
+    """ Base class of the backends. It keeps track of the variables and their bounds, which is enough to
+    reformulate indicator constraints as big-M constraints. """
+    # Whether the backend can solve the model, or only write it to a file
+    can_solve = True
+
+    def __init__(self):
+        self.names = []
+        self.lb = np.zeros(0)
+        self.ub = np.zeros(0)
+        self.types = []
+
+    def num_variables(self):
+        return len(self.names)
+
+    def num_constraints(self):
+        raise NotImplementedError()
+
+    def add_variables(self, names, obj, lb, ub, types):
+        """ Add the given variables and return their indices """
+        first = len(self.names)
+        names, types = list(names), list(types)
+        self.names += names
+        self.types += types
+        self.lb = np.concatenate((self.lb, np.asarray(lb, dtype=float)))
+        self.ub = np.concatenate((self.ub, np.asarray(ub, dtype=float)))
+        self._add_variables(names, [float(x) for x in obj], self.lb[first:], self.ub[first:], types)
+        return np.arange(first, first + len(names))
+
+    def add_linear_constraints(self, matrix, senses, rhs, names):
+        """ Add the constraints "row_i (senses[i]) rhs[i]", where row_i is the i-th row of the given CSR matrix
+        and the senses are 'L' (<=), 'G' (>=) or 'E' (=) """
+        self._add_linear_constraints(_as_csr(matrix), list(senses), [float(b) for b in rhs], list(names))
+
+    def add_indicator_constraints(self, matrix, sense, rhs, indvars, names):
+        """ Add the indicator constraints "indvars[i] = 1 -> row_i (sense) rhs[i]" """
+        self._add_big_m_constraints(_as_csr(matrix), sense, np.asarray(rhs, dtype=float),
+                                    np.asarray(indvars, dtype=np.int64), list(names))
+
+    def set_mip_start(self, indices, values):
+        """ Provide a (possibly partial) assignment of values to variables to start the search from """
+        pass
+
+    def solve(self):
+        """ Solve the model and return one of OPTIMAL, UNBOUNDED, INFEASIBLE or UNKNOWN """
+        raise NotImplementedError()
+
+    def get_values(self, indices):
+        raise NotImplementedError()
+
+    def get_objective_value(self):
+        raise NotImplementedError()
+
+    def write(self, filename):
+        raise NotImplementedError()
+
+    def _add_variables(self, names, obj, lb, ub, types):
+        raise NotImplementedError()
+
+    def _add_linear_constraints(self, matrix, senses, rhs, names):
+        raise NotImplementedError()
+
+    def _add_big_m_constraints(self, matrix, sense, rhs, indvars, names):
+        """ Reformulate "y = 1 -> a.x >= b" as "a.x - M*y >= b - M", with M = b - min(a.x), and analogously for
+        "<=". An equality becomes one constraint of each kind. """
+        indptr, indices, values = matrix
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        # The minimum and maximum values of each term over the bounds of its variable
+        low = np.where(values > 0, values * self.lb[indices], values * self.ub[indices]) if len(values) else values
+        high = np.where(values > 0, values * self.ub[indices], values * self.lb[indices]) if len(values) else values
+        if not np.isfinite(low).all() or not np.isfinite(high).all():
+            raise ValueError("Indicator constraints can only be reformulated with big-M over bounded variables")
+        row_min = np.bincount(rows, weights=low, minlength=len(rhs))
+        row_max = np.bincount(rows, weights=high, minlength=len(rhs))
+
+        for s in (["G", "L"] if sense == "E" else [sense]):
+            big_m = np.maximum(rhs - row_min, 0) if s == "G" else np.maximum(row_max - rhs, 0)
+            sign = -1 if s == "G" else 1
+            # Append the term sign*M*y at the end of each row
+            lengths = np.diff(indptr) + 1
+            new_indptr = np.concatenate(([0], np.cumsum(lengths)))
+            new_indices = np.empty(new_indptr[-1], dtype=np.int64)
+            new_values = np.empty(new_indptr[-1], dtype=float)
+            last = new_indptr[1:] - 1
+            mask = np.ones(new_indptr[-1], dtype=bool)
+            mask[last] = False
+            new_indices[mask], new_values[mask] = indices, values
+            new_indices[last], new_values[last] = indvars, sign * big_m
+            suffix = "" if sense != "E" else ("_ge" if s == "G" else "_le")
+            self._add_linear_constraints((new_indptr, new_indices, new_values), [s] * len(rhs),
+                                         (rhs + sign * big_m).tolist(), [n + suffix for n in names])
+
+
+def _as_csr(matrix):
+    indptr, indices, values = matrix
+    return np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=float)
+
+
+def _csr_rows(matrix):
+    """ Return the rows of the given CSR matrix as lists of (indices, values) """
+    indptr, indices, values = matrix
+    indices, values = indices.tolist(), values.tolist()
+    return [(indices[b:e], values[b:e]) for b, e in zip(indptr[:-1].tolist(), indptr[1:].tolist())]
+
+
+class CplexBackend(MIPBackend):
+    """ Solve the model with CPLEX, which supports indicator constraints natively """
+    def __init__(self):
+        super().__init__()
+        import cplex
+        self.cplex = cplex
+        self.problem = cplex.Cplex()
+        self.problem.objective.set_sense(self.problem.objective.sense.minimize)
+
+    def num_constraints(self):
+        return self.problem.linear_constraints.get_num() + self.problem.indicator_constraints.get_num()
+
+    def _bound(self, x):
+        return max(-self.cplex.infinity, min(self.cplex.infinity, x))
+
+    def _add_variables(self, names, obj, lb, ub, types):
+        self.problem.variables.add(obj=obj, lb=[self._bound(x) for x in lb.tolist()],
+                                   ub=[self._bound(x) for x in ub.tolist()], types=types, names=names)
+
+    def _add_linear_constraints(self, matrix, senses, rhs, names):
+        self.problem.linear_constraints.add(lin_expr=[list(row) for row in _csr_rows(matrix)], senses=senses, rhs=rhs,
+                                            names=names)
+
+    def add_indicator_constraints(self, matrix, sense, rhs, indvars, names):
+        rows = [self.cplex.SparsePair(ind=ind, val=val) for ind, val in _csr_rows(_as_csr(matrix))]
+        rhs, indvars, names = [float(b) for b in rhs], [int(y) for y in indvars], list(names)
+        n = len(rows)
+        if hasattr(self.problem.indicator_constraints, "add_batch"):
+            self.problem.indicator_constraints.add_batch(
+                lin_expr=rows, sense=[sense] * n, rhs=rhs, indvar=indvars, complemented=[0] * n, name=names)
+        else:  # Older versions of CPLEX can only add them one by one
+            for row, b, indvar, name in zip(rows, rhs, indvars, names):
+                self.problem.indicator_constraints.add(
+                    lin_expr=row, sense=sense, rhs=b, indvar=indvar, complemented=0, name=name)
+
+    def set_mip_start(self, indices, values):
+        self.problem.MIP_starts.add(self.cplex.SparsePair(ind=[int(i) for i in indices], val=[float(v) for v in values]),
+                                    self.problem.MIP_starts.effort_level.auto)
+
+    def solve(self):
+        self.problem.solve()
+        solution = self.problem.solution
+        # TODO: if we limit the time or accept suboptimal solutions, we will fall in the "unbounded" case.
+        # Is it right? How can we avoid it?
+        if solution.is_primal_feasible() and solution.is_dual_feasible():
+            return OPTIMAL
+        elif solution.is_primal_feasible():
+            return UNBOUNDED
+        elif solution.is_dual_feasible():
+            return INFEASIBLE
+        return UNKNOWN
+
+    def get_values(self, indices):
+        return self.problem.solution.get_values([int(i) for i in indices])
+
+    def get_objective_value(self):
+        return self.problem.solution.get_objective_value()
+
+    def write(self, filename):
+        self.problem.write(filename)
+
+
+class HighsBackend(MIPBackend):
+    """ Solve the model with the open-source HiGHS solver, through its highspy Python bindings """
+    def __init__(self):
+        super().__init__()
+        import highspy
+        self.highspy = highspy
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+        self.num_rows = 0
+
+    def num_constraints(self):
+        return self.num_rows
+
+    def _infinite(self, values):
+        inf = self.highspy.kHighsInf
+        return np.clip(np.asarray(values, dtype=float), -inf, inf)
+
+    def _add_variables(self, names, obj, lb, ub, types):
+        first, n = len(self.names) - len(names), len(names)
+        indices = np.arange(first, first + n, dtype=np.int32)
+        self.highs.addVars(n, self._infinite(lb), self._infinite(ub))
+        self.highs.changeColsCost(n, indices, np.asarray(obj, dtype=float))
+        integral = np.array([t != CONTINUOUS for t in types], dtype=bool)
+        if integral.any():
+            self.highs.changeColsIntegrality(int(integral.sum()), indices[integral],
+                                             np.array([self.highspy.HighsVarType.kInteger] * int(integral.sum())))
+        for i, name in zip(indices.tolist(), names):
+            self.highs.passColName(i, name)
+
+    def _add_linear_constraints(self, matrix, senses, rhs, names):
+        indptr, indices, values = matrix
+        rhs = np.asarray(rhs, dtype=float)
+        senses = np.array(senses)
+        inf = self.highspy.kHighsInf
+        lower = np.where(senses == "L", -inf, rhs)
+        upper = np.where(senses == "G", inf, rhs)
+        self.highs.addRows(len(rhs), lower, upper, len(indices), indptr[:-1].astype(np.int32),
+                           indices.astype(np.int32), values)
+        for i, name in enumerate(names, start=self.num_rows):
+            self.highs.passRowName(i, name)
+        self.num_rows += len(rhs)
+
+    def set_mip_start(self, indices, values):
+        solution = self.highspy.HighsSolution()
+        col_value = np.zeros(self.num_variables())
+        col_value[np.asarray(indices, dtype=np.int64)] = values
+        solution.col_value = col_value.tolist()
+        self.highs.setSolution(solution)
+
+    def solve(self):
+        self.highs.run()
+        status = self.highs.getModelStatus()
+        if status == self.highspy.HighsModelStatus.kOptimal:
+            return OPTIMAL
+        elif status == self.highspy.HighsModelStatus.kInfeasible:
+            return INFEASIBLE
+        elif status == self.highspy.HighsModelStatus.kUnbounded:
+            return UNBOUNDED
+        logging.warning("HiGHS finished with status {}".format(self.highs.modelStatusToString(status)))
+        return UNKNOWN
+
+    def get_values(self, indices):
+        values = self.highs.getSolution().col_value
+        return [values[i] for i in indices]
+
+    def get_objective_value(self):
+        return self.highs.getInfo().objective_function_value
+
+    def write(self, filename):
+        self.highs.writeModel(filename)
+
+
+class MIPFileWriter(MIPBackend):
+    """ Store the model in memory to write it in LP or MPS format (according to the extension of the filename),
+    so that it can be solved by some external solver. Indicator constraints are written as big-M constraints,
+    which all solvers understand. """
+    can_solve = False
+
+    def __init__(self):
+        super().__init__()
+        self.obj = []
+        self.rows = []
+        self.senses = []
+        self.rhs = []
+        self.row_names = []
+
+    def num_constraints(self):
+        return len(self.rows)
+
+    def _add_variables(self, names, obj, lb, ub, types):
+        self.obj += obj
+
+    def _add_linear_constraints(self, matrix, senses, rhs, names):
+        self.rows += _csr_rows(matrix)
+        self.senses += senses
+        self.rhs += rhs
+        self.row_names += names
+
+    def solve(self):
+        raise RuntimeError("The model can only be written to a file")
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            if filename.lower().endswith(".mps"):
+                self._write_mps(f)
+            else:
+                self._write_lp(f)
+
+    @staticmethod
+    def _number(x):
+        return repr(int(x)) if float(x).is_integer() else repr(float(x))
+
+    def _linear_expression(self, indices, values):
+        terms = ["{} {} {}".format("-" if v < 0 else "+", self._number(abs(v)), self.names[i])
+                 for i, v in zip(indices, values) if v != 0]
+        return " ".join(terms) if terms else "0 {}".format(self.names[0])
+
+    def _write_lp(self, f):
+        print("\\ Written by basilisk", file=f)
+        print("Minimize\n obj: {}".format(self._linear_expression(range(len(self.obj)), self.obj)), file=f)
+        print("Subject To", file=f)
+        symbols = dict(L="<=", G=">=", E="=")
+        for name, (indices, values), sense, rhs in zip(self.row_names, self.rows, self.senses, self.rhs):
+            print(" {}: {} {} {}".format(name, self._linear_expression(indices, values), symbols[sense],
+                                         self._number(rhs)), file=f)
+        print("Bounds", file=f)
+        for name, lb, ub in zip(self.names, self.lb.tolist(), self.ub.tolist()):
+            if lb == ub:
+                print(" {} = {}".format(name, self._number(lb)), file=f)
+            elif lb == -math.inf and ub == math.inf:
+                print(" {} free".format(name), file=f)
+            else:
+                lower = "-inf" if lb == -math.inf else self._number(lb)
+                upper = "+inf" if ub == math.inf else self._number(ub)
+                print(" {} <= {} <= {}".format(lower, name, upper), file=f)
+        for section, vartype in (("Binaries", BINARY), ("Generals", INTEGER)):
+            names = [name for name, t in zip(self.names, self.types) if t == vartype]
+            if names:
+                print(section, file=f)
+                print("\n".join(" " + name for name in names), file=f)
+        print("End", file=f)
+
+    def _write_mps(self, f):
+        # Free MPS format: names must not contain spaces
+        print("NAME basilisk", file=f)
+        print("ROWS\n N obj", file=f)
+        for name, sense in zip(self.row_names, self.senses):
+            print(" {} {}".format(sense, name), file=f)
+
+        columns = [[] for _ in self.names]
+        for name, (indices, values) in zip(self.row_names, self.rows):
+            for i, v in zip(indices, values):
+                columns[i].append((name, v))
+        print("COLUMNS", file=f)
+        in_integer_block = False
+        for i, (name, entries) in enumerate(zip(self.names, columns)):
+            integer = self.types[i] != CONTINUOUS
+            if integer != in_integer_block:
+                print("    MARKER 'MARKER' '{}'".format("INTORG" if integer else "INTEND"), file=f)
+                in_integer_block = integer
+            entries = [("obj", self.obj[i])] + entries
+            for row, v in entries:
+                print("    {} {} {}".format(name, row, self._number(v)), file=f)
+        if in_integer_block:
+            print("    MARKER 'MARKER' 'INTEND'", file=f)
+
+        print("RHS", file=f)
+        for name, rhs in zip(self.row_names, self.rhs):
+            if rhs != 0:
+                print("    RHS {} {}".format(name, self._number(rhs)), file=f)
+
+        print("BOUNDS", file=f)
+        for name, lb, ub in zip(self.names, self.lb.tolist(), self.ub.tolist()):
+            if lb == ub:
+                print(" FX BND {} {}".format(name, self._number(lb)), file=f)
+                continue
+            if lb == -math.inf and ub == math.inf:
+                print(" FR BND {}".format(name), file=f)
+                continue
+            # Integer variables in MPS default to binary in some solvers, so we always write both bounds
+            print(" MI BND {}".format(name) if lb == -math.inf else " LO BND {} {}".format(name, self._number(lb)),
+                  file=f)
+            print(" PL BND {}".format(name) if ub == math.inf else " UP BND {} {}".format(name, self._number(ub)),
+                  file=f)
+        print("ENDATA", file=f)
+
+
+BACKENDS = dict(
+    cplex=CplexBackend,
+    highs=HighsBackend,
+    lp=MIPFileWriter,
+    mps=MIPFileWriter,
+)
+
+
+def create_backend(solver):
+    """ Create the backend for the given solver, one of the keys of BACKENDS. The "lp" and "mps" backends only
+    write the model to a file of the respective format. """
+    return BACKENDS[solver]()
@@ -2,42 +2,59 @@
 
 import sys
 
+import numpy as np
 
-def read_transition_file(path):
-    transitions = []
-    adj_list = {}
 
-    with open(path, 'r') as f:
-        for line in f.readlines():
-            parts = line.split()
-            state, targets = parts[0], parts[1:]
-            adj_list['s' + state] = []
-            for transition in targets:
-                transitions.append(("s" + state, "s" + transition))
-                adj_list['s' + state].append("s" + transition)
-    return transitions, adj_list
+def read_feature_matrix(path):
+    """ Return the ids of the states in the given feature matrix file, and the matrix with the values of the features
+    in these states, one row per state. A matrix stored in NumPy format (.npy), with the id of each state in the
+    first column, is memory-mapped instead of read. """
+    if path.endswith(".npy"):
+        data = np.load(path, mmap_mode='r')
+    else:
+        with open(path, 'r') as f:
+            num_columns = len(f.readline().split())
+        data = np.fromfile(path, dtype=np.int64, sep=' ').reshape(-1, num_columns)
+    assert len(data) > 0
+    return data[:, 0], data[:, 1:]
+
+
+def index_states(state_ids):
+    """ Return the array that maps the id of each of the given states to its index (-1 for other ids) """
+    state_index = np.full(int(state_ids.max()) + 1, -1, dtype=np.int64)
+    state_index[state_ids] = np.arange(len(state_ids))
+    return state_index
 
 
-def read_features_file(path):
-    features_per_state = {}
+def read_transitions(path, state_index):
+    """ Return the transitions in the given file as a CSR matrix (indptr, targets) over the state indices given by
+    state_index: the successors of the state with index i are targets[indptr[i]:indptr[i + 1]], in the order of
+    the file """
     with open(path, 'r') as f:
-        for line in f.readlines():
-            parts = line.split()
-            state = 's' + parts[0]
-            features_per_state[state] = [int(feature) for feature in parts[1:]]
-    assert features_per_state
-    return features_per_state, \
-        len(next(iter(features_per_state.values())))  # get the len of any element, they'll all be equal
+        lines = [parts for parts in (line.split() for line in f) if parts]
+    lengths = np.array([len(parts) for parts in lines], dtype=np.int64)
+    ids = np.fromiter((int(x) for parts in lines for x in parts), dtype=np.int64, count=int(lengths.sum()))
+    states = state_index[ids]
+    assert (states >= 0).all(), "All states with transitions must be in the feature matrix"
 
+    # The first state of each line is the source of the transitions to the remaining states
+    first = np.cumsum(lengths) - lengths
+    is_source = np.zeros(len(states), dtype=bool)
+    is_source[first] = True
+    sources = np.repeat(states[first], lengths - 1)
+    order = np.argsort(sources, kind="stable")
+    num_states = int(state_index.max()) + 1
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=num_states))))
+    return indptr, states[~is_source][order]
 
-def read_state_set(path):
-    goal_states = []
 
-    with open(path, 'r') as f:
-        for line in f.readlines():
-            for state in line.split():
-                goal_states.append('s' + state)
-    return set(x for x in goal_states)
+def read_state_flags(path, state_index):
+    """ Return the boolean array that tells which of the states indexed by state_index are in the given file """
+    ids = np.fromfile(path, dtype=np.int64, sep=' ')
+    states = state_index[ids[ids < len(state_index)]]
+    flags = np.zeros(int(state_index.max()) + 1, dtype=bool)
+    flags[states[states >= 0]] = True
+    return flags
 
 
 def read_complexity_file(path):
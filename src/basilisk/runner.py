@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
 import logging
 
-import cplex
 import math
 import sys
+from collections import namedtuple
+
+import numpy as np
 from sltp.errors import CriticalPipelineError
 from sltp.returncodes import ExitCode
 from tarski.dl import EmpiricalBinaryConcept, ConceptCardinalityFeature
 
+from . import mip
 from .read_input import *
 from .search import hill_climbing
-from .utils import natural_sort
 
 
 def get_weight_var(f):
@@ -18,244 +20,407 @@ def get_weight_var(f):
     return 'w_' + str(f)
 
 
-def get_y_var(s, t):
-    """ Return the name of the binary aux variable given the transition """
-    return 'y_' + s + '_' + t
+# The indices of the variables of the MIP, as numpy arrays. weights[f] is the weight variable of feature f, and y[g]
+# the y-variable of the transition group g. `aux` maps the names of the variables that are specific to the objective
+# function (e.g. "xplus") to their indices.
+MIPVariables = namedtuple("MIPVariables", ["weights", "y", "dummy", "aux"])
+
+# The transitions of the sample over integer state indices: the feature matrix has one row per state (whose ids in
+# the input files are given by state_ids), and transition i goes from state starts[i] to state finals[i].
+# The transitions that start in an alive state and change the value of some feature are grouped by their vector of
+# feature differences [f]^s - [f]^s': transition_group[i] is the group of transition i (-1 if it has none),
+# group_deltas the CSR matrix (indptr, feature indices, values) with the nonzero differences of each group, and
+# group_transitions[g] the first transition of group g.
+IndexedSample = namedtuple("IndexedSample", ["state_ids", "matrix", "starts", "finals", "is_goal", "is_unsolvable",
+                                             "transition_group", "group_deltas", "group_transitions"])
+
+
+def index_sample(state_ids, matrix, transitions, is_goal, is_unsolvable):
+    """ Return the IndexedSample with the given states and CSR matrix (indptr, targets) of transitions """
+    indptr, targets = transitions
+    starts = np.repeat(np.arange(len(state_ids)), np.diff(indptr))
+    return group_transitions(state_ids, matrix, starts, targets, is_goal, is_unsolvable)
+
+
+def group_transitions(state_ids, matrix, starts, finals, is_goal, is_unsolvable):
+    """ Return the IndexedSample with the given states and transitions """
+    # Transitions with the same feature differences impose the same constraint on the weights, and a transition that
+    # doesn't change any feature can never be improving, so it needs no y-variable either
+    alive = np.flatnonzero(~is_goal[starts] & ~is_unsolvable[starts])
+    group_deltas, groups, first = unique_deltas(matrix, starts[alive], finals[alive])
+    transition_group = np.full(len(starts), -1, dtype=np.int64)
+    transition_group[alive] = groups
+    return IndexedSample(state_ids, matrix, starts, finals, is_goal, is_unsolvable,
+                         transition_group, group_deltas, alive[first])
+
+
+def find_nonredundant_features(matrix, feature_complexity):
+    """ Return the sorted indices of the features that are not redundant in the given feature matrix, together with
+    the factor by which the max. weight of each of them needs to be scaled. The heuristic only depends on the
+    differences of the feature values along transitions, so a feature that is constant over the sampled states can
+    never help, and a feature g with differences a_g times those of some other feature f can be replaced by f. Of
+    each class of such features, we keep the one with the lowest complexity (and the lowest index among those).
+    Any combination sum_g w_g*[g] of the features of the class, with |w_g| <= M, is equivalent to a single weight
+    of f whose absolute value is at most M * sum_g |a_g|, so with the max. weight of f scaled by sum_g |a_g| every
+    solution of the full MIP has a counterpart of no greater complexity. The reduced MIP is thus feasible iff the
+    full one is, and its optimal complexity is at most that of the full MIP, but it can be strictly lower, with
+    learnt weights above the max. weight (where the full MIP would need several features of the class). """
+    deltas = (matrix - matrix[:1]).astype(float)
+    nonconstant = np.flatnonzero(deltas.any(axis=0))
+    complexity = np.asarray(feature_complexity)[nonconstant]
+    candidates = nonconstant[np.lexsort((nonconstant, complexity))]
+
+    # Scale each column so that its first nonzero difference is 1, which leaves equal the columns of each class
+    columns = deltas[:, candidates]
+    pivots = columns[np.argmax(columns != 0, axis=0), np.arange(len(candidates))]
+    _, first, inverse = np.unique(np.round(columns / pivots, 9), axis=1, return_index=True, return_inverse=True)
+    # The differences of each feature g are pivot_g / pivot_f times those of the kept feature f of its class
+    magnitudes = np.abs(pivots)
+    scales = np.bincount(inverse.reshape(-1), weights=magnitudes, minlength=len(first)) / magnitudes[first]
+    order = np.argsort(candidates[first])
+    return candidates[first][order], scales[order]
+
+
+def select_features(sample, features):
+    """ Return the IndexedSample over the given subset of the features of the given sample """
+    return group_transitions(sample.state_ids, sample.matrix[:, features], sample.starts, sample.finals,
+                             sample.is_goal, sample.is_unsolvable)
+
+
+def restrict_sample(sample, states):
+    """ Return the IndexedSample with only the transitions of the given sample that start in the given states """
+    transitions = np.flatnonzero(np.isin(sample.starts, states))
+    return group_transitions(sample.state_ids, sample.matrix, sample.starts[transitions], sample.finals[transitions],
+                             sample.is_goal, sample.is_unsolvable)
+
+
+def find_violated_states(sample, weights, tolerance=1e-6):
+    """ Return the states of the sample in which the potential heuristic with the given weights is not descending
+    (an alive state with transitions, none of which decreases the heuristic by at least 1) or not dead-end-avoiding
+    (a solvable state with a transition to an unsolvable state that decreases the heuristic) """
+    h = sample.matrix @ np.asarray(weights, dtype=float)
+    decrease = h[sample.starts] - h[sample.finals]
+    alive = ~sample.is_goal[sample.starts] & ~sample.is_unsolvable[sample.starts]
+
+    violated = np.zeros(len(sample.state_ids), dtype=bool)
+    violated[sample.starts[alive]] = True
+    violated[sample.starts[alive & (decrease >= 1 - tolerance)]] = False
+    dead_end = ~sample.is_unsolvable[sample.starts] & sample.is_unsolvable[sample.finals]
+    violated[sample.starts[dead_end & (decrease > tolerance)]] = True
+    return np.flatnonzero(violated)
+
+
+def unique_deltas(matrix, starts, finals):
+    """ Return the distinct nonzero vectors of feature differences of the given transitions as a CSR matrix over
+    feature indices, together with the index of the vector of each transition (-1 for those that don't change any
+    feature) and the index of the first transition with each vector. Vectors are numbered in order of appearance. """
+    deltas = matrix[starts] - matrix[finals]
+    if len(deltas) == 0:
+        return (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=deltas.dtype)), \
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    unique, first, inverse = np.unique(deltas, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Renumber the vectors by their first transition, dropping the zero vector
+    nonzero = np.flatnonzero(unique.any(axis=1))
+    nonzero = nonzero[np.argsort(first[nonzero], kind="stable")]
+    renumbering = np.full(len(unique), -1, dtype=np.int64)
+    renumbering[nonzero] = np.arange(len(nonzero))
+    unique = unique[nonzero]
+
+    rows, columns = np.nonzero(unique)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(unique)))))
+    return (indptr, columns, unique[rows, columns]), renumbering[inverse], first[nonzero]
+
+
+def weight_rows(variables, deltas):
+    """ Return the CSR matrix with the rows sum_f w_f*([f]^s - [f]^s') for the given CSR matrix of feature
+    differences """
+    indptr, features, values = deltas
+    return indptr, variables.weights[features], values
+
+
+def select_rows(matrix, rows):
+    """ Return the CSR matrix with the given rows of the given CSR matrix """
+    indptr, indices, values = matrix
+    rows = np.asarray(rows, dtype=np.int64)
+    lengths = indptr[rows + 1] - indptr[rows]
+    new_indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    positions = np.arange(new_indptr[-1]) - np.repeat(new_indptr[:-1] - indptr[rows], lengths)
+    return new_indptr, indices[positions], values[positions]
+
+
+def row_keys(matrix):
+    """ Return a hashable key with the content of each row of the given CSR matrix """
+    indptr, indices, values = matrix
+    indices, values = np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=float)
+    return [(indices[b:e].tobytes(), values[b:e].tobytes()) for b, e in zip(indptr[:-1].tolist(), indptr[1:].tolist())]
+
+
+def add_weight_variables(problem, num_features, lb, ub, vartype):
+    """ Add the weight variables, with the given bounds (either one for all features or one per feature) """
+    n = num_features
+    return problem.add_variables([get_weight_var(f) for f in range(n)], obj=[0] * n, lb=np.broadcast_to(lb, n),
+                                 ub=np.broadcast_to(ub, n), types=[vartype] * n)
+
+
+def add_y_variables(problem, names):
+    n = len(names)
+    return problem.add_variables(names, obj=[0] * n, lb=[0] * n, ub=[1] * n, types=[mip.BINARY] * n)
+
+
+def add_dummy_variable(problem):
+    return int(problem.add_variables(["dummy"], obj=[0], lb=[1], ub=[1], types=[mip.INTEGER])[0])
 
 
 # Populate obj function and add all variables
-def populate_obj_function_min_complexity(problem, num_features, max_weight, transitions, feature_complexity, goal_states):
+def populate_obj_function_min_complexity(problem, max_weight, feature_complexity):
     # Add variables that occur in the opt function
-    for f in range(0, num_features):
-        problem.variables.add(names=['xplus_' + str(f), 'xminus_' + str(f)],
-                              obj=[feature_complexity[f], feature_complexity[f]],
-                              types=[problem.variables.type.binary] * 2)
+    num_features = len(feature_complexity)
+    binary = [mip.BINARY] * num_features
+    xplus = problem.add_variables(['xplus_' + str(f) for f in range(num_features)],
+                          obj=feature_complexity, lb=[0] * num_features, ub=[1] * num_features, types=binary)
+    xminus = problem.add_variables(['xminus_' + str(f) for f in range(num_features)],
+                           obj=feature_complexity, lb=[0] * num_features, ub=[1] * num_features, types=binary)
 
     # add weights
-    for f in range(0, num_features):
-        problem.variables.add(names=[get_weight_var(f)],
-                              obj=[0],
-                              lb=[-1 * max_weight], ub=[max_weight],
-                              types=[problem.variables.type.continuous])
-                              #types=[problem.variables.type.integer])
-
-    # add binary to each transition
-    for t in transitions:
-        if t[0] in goal_states:
-            continue
-
-        problem.variables.add(names=[get_y_var(t[0], t[1])],
-                              obj=[0],
-                              types=[problem.variables.type.binary])
+    weights = add_weight_variables(problem, num_features, -1 * np.asarray(max_weight), max_weight,
+                                   mip.CONTINUOUS)
+    # the y-variables are added together with the groups of transitions
+    y = np.zeros(0, dtype=np.int64)
+    dummy = add_dummy_variable(problem)
+    return MIPVariables(weights, y, dummy, dict(xplus=xplus, xminus=xminus))
 
-    problem.variables.add(names=["dummy"], obj=[0], lb=[1], ub=[1], types=[problem.variables.type.integer])
 
 # Populate obj function
-def populate_obj_function_max_nonselected_complexity(problem, num_features, max_weight, transitions, feature_complexity, goal_states):
+def populate_obj_function_max_nonselected_complexity(problem, max_weight, feature_complexity):
     # Add variables that occur in the opt function
-    for f in range(0, num_features):
-        problem.variables.add(names=['z_w_' + str(f)],
-                              obj=[feature_complexity[f]],
-                              types=[problem.variables.type.binary])
-
+    num_features = len(feature_complexity)
+    z = problem.add_variables(['z_w_' + str(f) for f in range(num_features)],
+                      obj=feature_complexity, lb=[0] * num_features, ub=[1] * num_features,
+                      types=[mip.BINARY] * num_features)
 
     # add weights
-    for f in range(0, num_features):
-        problem.variables.add(names=[get_weight_var(f)],
-                              obj=[0],
-                              lb=[-1 * cplex.infinity], ub=[cplex.infinity],
-                              types=[problem.variables.type.continuous])
-
-    # add binary to each transition
-    for t in transitions:
-        if t[0] in goal_states:
-            continue
+    weights = add_weight_variables(problem, num_features, -1 * math.inf, math.inf,
+                                   mip.CONTINUOUS)
+    # the y-variables are added together with the groups of transitions
+    y = np.zeros(0, dtype=np.int64)
+    dummy = add_dummy_variable(problem)
+    return MIPVariables(weights, y, dummy, dict(z=z))
 
-        problem.variables.add(names=[get_y_var(t[0], t[1])],
-                              obj=[0],
-                              types=[problem.variables.type.binary])
-
-    problem.variables.add(names=["dummy"], obj=[0], lb=[1], ub=[1], types=[problem.variables.type.integer])
 
 # Populate obj function
-def populate_obj_function_min_weighted_complexity(problem, num_features, max_weight, transitions, feature_complexity, goal_states):
+def populate_obj_function_min_weighted_complexity(problem, max_weight, feature_complexity):
     # Add variables that occur in the opt function
-    for f in range(0, num_features):
-        problem.variables.add(names=['abs_w_' + str(f)],
-                              obj=[feature_complexity[f]],
-                              lb=[0],
-                              ub=[1 * cplex.infinity],
-                              types=[problem.variables.type.continuous])
+    num_features = len(feature_complexity)
+    abs_w = problem.add_variables(['abs_w_' + str(f) for f in range(num_features)],
+                          obj=feature_complexity, lb=[0] * num_features, ub=[1 * math.inf] * num_features,
+                          types=[mip.CONTINUOUS] * num_features)
 
     # add weights
-    for f in range(0, num_features):
-        problem.variables.add(names=[get_weight_var(f)],
-                              lb=[-1 * cplex.infinity], ub=[cplex.infinity],
-                              obj=[0],
-                              types=[problem.variables.type.integer])
-
-    # add binary to each transition
-    for t in transitions:
-        if t[0] in goal_states:
-            continue
-
-        problem.variables.add(names=[get_y_var(t[0], t[1])],
-                              obj=[0],
-                              types=[problem.variables.type.binary])
-
-    problem.variables.add(names=["dummy"], obj=[0], lb=[1], ub=[1], types=[problem.variables.type.integer])
-
-
-# Populate constraints (4a) in the draft
-def populate_weight_constraints(problem, transitions, features, goal_states, unsolvable_states):
-    for start_node, final_node in transitions:
-
-        coefficients = []
-        names = []
-
-        if start_node in goal_states or start_node in unsolvable_states:
-            continue
-
-        constraint_name = "c_" + start_node + "_" + final_node
-        features_start = features[start_node]
-        features_final = features[final_node]
-        sum_delta_f = 0
-
-        # Add w_f*([f]^s - [f]^s') to every feature
-        for f, (start_f, final_f) in enumerate(zip(features_start, features_final)):
-            w_name = get_weight_var(f)
-            delta_f = start_f - final_f
-            sum_delta_f += abs(delta_f)
-            coefficients.append(delta_f)
-            names.append(w_name)
-
-        problem.indicator_constraints.add(
-            indvar=get_y_var(start_node, final_node),
-            complemented=0,
-            rhs=1,
-            sense="G",
-            lin_expr=cplex.SparsePair(ind=names, val=coefficients),
-            name=constraint_name)
-
-
-def populate_dead_end_constraints(problem, transitions, features, goal_states, unsolvable_states):
-    for start_node, final_node in transitions:
-        '''
-        We are doing almost the same thing as the weight constraints here.
-        Maybe we can save some work if we merge both functions?
-        '''
-        coefficients = []
-        names = []
-
-        if start_node in unsolvable_states or final_node not in unsolvable_states:
-            continue
-
-        constraint_name = "d_" + start_node + "_" + final_node
-        features_start = features[start_node]
-        features_final = features[final_node]
-
-        for f, (start_f, final_f) in enumerate(zip(features_start, features_final)):
-            w_name = get_weight_var(f)
-            delta_f = start_f - final_f
-            coefficients.append(delta_f)
-            names.append(w_name)
-
-        problem.linear_constraints.add(
-            lin_expr=[cplex.SparsePair(ind=names, val=coefficients)],
-            senses=["L"],
-            rhs=[0],
-            names=[constraint_name])
-
-
-# Populate constraints (4b) in the draft
-def populate_y_constraints(problem, adj_list, goal_states, unsolvable_states):
-    for start in adj_list:
-        if start in goal_states or not adj_list[start] or start in unsolvable_states:
-            continue
-        constraint_name = "c_y_" + start
-        problem.linear_constraints.add(names=[constraint_name])
-        coefficients = []
-        for final in adj_list[start]:
-            var = get_y_var(start, final)
-            coefficients.append((constraint_name, var, 1))
-        problem.linear_constraints.set_coefficients(coefficients)
-        problem.linear_constraints.set_rhs(constraint_name, 1)
-        problem.linear_constraints.set_senses(constraint_name, "G")
+    weights = add_weight_variables(problem, num_features, -1 * math.inf, math.inf,
+                                   mip.INTEGER)
+    # the y-variables are added together with the groups of transitions
+    y = np.zeros(0, dtype=np.int64)
+    dummy = add_dummy_variable(problem)
+    return MIPVariables(weights, y, dummy, dict(abs_w=abs_w))
+
+
+def _pairs_to_csr(columns, values):
+    """ Return the CSR matrix whose i-th row has the entries columns[i] with values[i], for equally-sized rows """
+    num_rows, width = columns.shape
+    return np.arange(num_rows + 1) * width, columns.ravel(), values.ravel()
 
 
 # Populate constraints (7,8,9) in the draft
-def populate_max_weight_constraints(problem, num_features, max_weight):
-    coefficients = []
-    for f in range(0, num_features):
-        w_name = get_weight_var(f)
-
-        # x_+ constraint
-        xplus_name = 'c_xplus_' + str(f)
-        problem.linear_constraints.add(names=[xplus_name])
-        coefficients.append((xplus_name, w_name, -1))
-        coefficients.append((xplus_name, 'xplus_' + str(f), max_weight))
-        problem.linear_constraints.set_rhs(xplus_name, 0)
-        problem.linear_constraints.set_senses(xplus_name, "G")
-
-        # x_- constraint
-        xminus_name = 'c_xminus_' + str(f)
-        problem.linear_constraints.add(names=[xminus_name])
-        coefficients.append((xminus_name, w_name, 1))
-        coefficients.append((xminus_name, 'xminus_' + str(f), max_weight))
-        problem.linear_constraints.set_rhs(xminus_name, 0)
-        problem.linear_constraints.set_senses(xminus_name, "G")
-
-        # w_f <= max_weight constraint
-        c_max_weight_name = "c_max_w_" + w_name
-        problem.linear_constraints.add(names=[c_max_weight_name])
-        coefficients.append((c_max_weight_name, w_name, 1))
-        coefficients.append((c_max_weight_name, "dummy", -1 * max_weight))
-        problem.linear_constraints.set_rhs(c_max_weight_name, 0)
-        problem.linear_constraints.set_senses(c_max_weight_name, "L")
-    problem.linear_constraints.set_coefficients(coefficients)
-
-def populate_weight_selection_constraints(problem, num_features, max_weight):
-    coefficients = []
-    for f in range(0, num_features):
-        w_name = get_weight_var(f)
-        z_var = 'z_w_' + str(f)
-        constraint_name = 'c_z_w_' + str(f)
-        problem.indicator_constraints.add(
-            indvar=z_var,
-            complemented=0,
-            rhs=0,
-            sense="E",
-            lin_expr=cplex.SparsePair(ind=[w_name], val=[1]),
-            name=constraint_name)
-
-
-def populate_absolute_value_weight_constraints(problem, num_features, max_weight):
-    coefficients = []
-    for f in range(0, num_features):
-        w_name = get_weight_var(f)
-
-        # x_+ constraint
-        xplus_name = 'c_abs_w_plus_' + str(f)
-        problem.linear_constraints.add(names=[xplus_name])
-        coefficients.append((xplus_name, w_name, -1))
-        coefficients.append((xplus_name, 'abs_w_' + str(f), 1))
-        problem.linear_constraints.set_rhs(xplus_name, 0)
-        problem.linear_constraints.set_senses(xplus_name, "G")
-
-        # x_- constraint
-        xminus_name = 'c_abs_w_minus_' + str(f)
-        problem.linear_constraints.add(names=[xminus_name])
-        coefficients.append((xminus_name, w_name, 1))
-        coefficients.append((xminus_name, 'abs_w_' + str(f), 1))
-        problem.linear_constraints.set_rhs(xminus_name, 0)
-        problem.linear_constraints.set_senses(xminus_name, "G")
-
-    problem.linear_constraints.set_coefficients(coefficients)
-
-def extract_heuristic_parameters_from_cplex_solution(problem, nfeatures):
+def populate_max_weight_constraints(problem, variables, max_weight):
+    weights, xplus, xminus = variables.weights, variables.aux["xplus"], variables.aux["xminus"]
+    num_features = len(weights)
+    features = range(num_features)
+    dummy = np.full(num_features, variables.dummy)
+    # The max. weight can be given per feature
+    bounds = np.broadcast_to(np.asarray(max_weight, dtype=float), (num_features,))
+    ones = np.ones(num_features)
+
+    # x_+ constraints: M * xplus_f - w_f >= 0
+    # x_- constraints: M * xminus_f + w_f >= 0
+    # w_f <= max_weight constraints: w_f - M * dummy <= 0
+    columns = np.concatenate((np.stack((weights, xplus), axis=1), np.stack((weights, xminus), axis=1),
+                              np.stack((weights, dummy), axis=1)))
+    values = np.concatenate((np.stack((-ones, bounds), axis=1), np.stack((ones, bounds), axis=1),
+                             np.stack((ones, -bounds), axis=1)))
+    names = (['c_xplus_' + str(f) for f in features] + ['c_xminus_' + str(f) for f in features] +
+             ["c_max_w_" + get_weight_var(f) for f in features])
+    problem.add_linear_constraints(_pairs_to_csr(columns, values), "G" * (2 * num_features) +
+                                   "L" * num_features, [0] * (3 * num_features), names)
+
+
+def populate_weight_selection_constraints(problem, variables, max_weight):
+    weights, z = variables.weights, variables.aux["z"]
+    num_features = len(weights)
+    rows = _pairs_to_csr(weights.reshape(-1, 1), np.ones((num_features, 1)))
+    problem.add_indicator_constraints(rows, "E", [0] * num_features, z,
+                                      ['c_z_w_' + str(f) for f in range(num_features)])
+
+
+def populate_absolute_value_weight_constraints(problem, variables, max_weight):
+    weights, abs_w = variables.weights, variables.aux["abs_w"]
+    num_features = len(weights)
+    features = range(num_features)
+
+    # abs_w_f - w_f >= 0 and abs_w_f + w_f >= 0
+    columns = np.concatenate((np.stack((weights, abs_w), axis=1), np.stack((weights, abs_w), axis=1)))
+    values = np.array([[-1, 1]] * num_features + [[1, 1]] * num_features).reshape(-1, 2)
+    names = ['c_abs_w_plus_' + str(f) for f in features] + ['c_abs_w_minus_' + str(f) for f in features]
+    problem.add_linear_constraints(_pairs_to_csr(columns, values), "G" * (2 * num_features),
+                                   [0] * (2 * num_features), names)
+
+
+class WeightMIP:
+    """ The MIP that learns the weights of the potential heuristic, over a sample of transitions that can grow
+    between solves.
+
+    Constraints are identified by their content rather than by the states they come from: the weight constraint
+    of a group of transitions by its vector of feature differences, and the y-constraint of a state by the set of
+    y-variables of its transitions. Each of them is added only once, so that `update` with a larger sample over the
+    same features (e.g. the working sample plus the flaws found in the incremental approach) only adds the
+    constraints and y-variables of the new states, and `solve` starts from the weights of the previous solution.
+    If the features or their max. weights change, the model is built anew.
+    """
+    def __init__(self, solver, max_weight):
+        self.solver = solver
+        self.max_weight = max_weight
+        self.problem = None
+        self.variables = None
+        self.features = None
+        # The weights of the last optimal solution, by feature name
+        self.last_weights = None
+
+    def _build(self, feature_names, feature_complexity, weight_scales):
+        self.problem = mip.create_backend(self.solver)
+        self.features = (list(feature_names), list(feature_complexity), weight_scales)
+        max_weight = self.max_weight if weight_scales is None else self.max_weight * np.asarray(weight_scales)
+
+        logging.info("Populating objective function")
+        # See the code for options on obj function
+        self.variables = populate_obj_function_min_complexity(self.problem, max_weight, feature_complexity)
+        #self.variables = populate_obj_function_max_nonselected_complexity(self.problem, self.max_weight,
+        #                                                                  feature_complexity)
+        logging.info("Populating M_w-constraints")
+
+        # This function requires the min weighted complexity obj function. Otherwise, use the max weight constraints
+        #populate_absolute_value_weight_constraints(self.problem, self.variables, self.max_weight)
+        #populate_weight_selection_constraints(self.problem, self.variables, self.max_weight)
+        populate_max_weight_constraints(self.problem, self.variables, max_weight)
+
+        # The y-variable of each vector of feature differences in the model, and the CSR matrices of these vectors,
+        # in the order of their y-variables
+        self.groups = dict()
+        self.group_deltas = []
+        self.dead_ends = set()
+        self.y_constraints = set()
+
+    def update(self, sample, feature_names, feature_complexity, weight_scales=None):
+        """ Add the constraints of the given IndexedSample that are not in the model yet. If given, the max. weight
+        of each feature is scaled by the corresponding factor of weight_scales. """
+        if weight_scales is not None:
+            weight_scales = tuple(float(x) for x in weight_scales)
+        if self.problem is None or self.features != (list(feature_names), list(feature_complexity), weight_scales):
+            if self.problem is not None:
+                logging.info("The features have changed, building the MIP anew")
+            self._build(feature_names, feature_complexity, weight_scales)
+
+        logging.info("Populating weight constraints")
+        group_y = self._add_weight_constraints(sample)
+        logging.info("Populating dead-end constraints")
+        self._add_dead_end_constraints(sample)
+        logging.info("Populating y-constraints")
+        self._add_y_constraints(sample, group_y)
+
+    # Populate constraints (4a) in the draft
+    def _add_weight_constraints(self, sample):
+        """ Add one constraint y_g -> sum_f w_f*([f]^s - [f]^s') >= 1, with only the nonzero differences, for each
+        group of transitions that is new to the model, and return the y-variables of all groups of the sample """
+        keys = row_keys(sample.group_deltas)
+        new = [g for g, key in enumerate(keys) if key not in self.groups]
+        first = len(self.groups)
+        deltas = select_rows(sample.group_deltas, new)
+        y = add_y_variables(self.problem, ["y_" + str(g) for g in range(first, first + len(new))])
+        self.variables = self.variables._replace(y=np.concatenate((self.variables.y, y)))
+        self.problem.add_indicator_constraints(weight_rows(self.variables, deltas), "G", [1] * len(new), y,
+                                               ["c_" + str(g) for g in range(first, first + len(new))])
+        self.groups.update(zip((keys[g] for g in new), y.tolist()))
+        self.group_deltas.append(deltas)
+        return np.array([self.groups[key] for key in keys], dtype=np.int64)
+
+    def _add_dead_end_constraints(self, sample):
+        # Transitions with the same feature differences yield the same constraint, which we add only once
+        transitions = np.flatnonzero(~sample.is_unsolvable[sample.starts] & sample.is_unsolvable[sample.finals])
+        deltas, _, _ = unique_deltas(sample.matrix, sample.starts[transitions], sample.finals[transitions])
+        keys = row_keys(deltas)
+        new = [i for i, key in enumerate(keys) if key not in self.dead_ends]
+        first = len(self.dead_ends)
+        self.problem.add_linear_constraints(weight_rows(self.variables, select_rows(deltas, new)), "L" * len(new),
+                                            [0] * len(new), ["d_" + str(i) for i in range(first, first + len(new))])
+        self.dead_ends.update(keys[i] for i in new)
+
+    # Populate constraints (4b) in the draft
+    def _add_y_constraints(self, sample, group_y):
+        # One constraint for each alive state with some outgoing transition, over the y-variables of the groups of its
+        # transitions. A state whose transitions don't change any feature gets an empty (unsatisfiable) constraint.
+        alive = np.flatnonzero(~sample.is_goal[sample.starts] & ~sample.is_unsolvable[sample.starts])
+        states = np.unique(sample.starts[alive])
+        grouped = alive[sample.transition_group[alive] >= 0]
+        pairs = np.unique(np.stack((sample.starts[grouped], group_y[sample.transition_group[grouped]]), axis=1),
+                          axis=0).reshape(-1, 2)
+        indptr = np.append(np.searchsorted(pairs[:, 0], states), len(pairs)).tolist()
+        y = pairs[:, 1].tolist()
+
+        # States with the same y-variables yield the same constraint
+        new = dict.fromkeys(key for key in (tuple(y[b:e]) for b, e in zip(indptr[:-1], indptr[1:]))
+                            if key not in self.y_constraints)
+        first = len(self.y_constraints)
+        lengths = [len(key) for key in new]
+        rows = (np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+                np.array([v for key in new for v in key], dtype=np.int64), np.ones(sum(lengths), dtype=np.int64))
+        self.problem.add_linear_constraints(rows, "G" * len(new), [1] * len(new),
+                                            ["c_y_" + str(i) for i in range(first, first + len(new))])
+        self.y_constraints.update(new)
+
+    def _set_mip_start(self):
+        """ Start from the weights of the last solution (zero for the features that it didn't have), with the
+        y-variables and the variables of the objective function that these weights imply """
+        names = self.features[0]
+        weights = np.array([self.last_weights.get(name, 0) for name in names], dtype=float)
+        variables = self.variables
+        indices, values = [variables.weights, [variables.dummy]], [weights, [1]]
+
+        lengths = np.concatenate([np.diff(indptr) for indptr, _, _ in self.group_deltas])
+        features = np.concatenate([features for _, features, _ in self.group_deltas])
+        deltas = np.concatenate([deltas for _, _, deltas in self.group_deltas])
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        potential_change = np.bincount(rows, weights=deltas * weights[features], minlength=len(lengths))
+        indices.append(variables.y)
+        values.append((potential_change >= 1 - 1e-6).astype(float))
+        if "xplus" in variables.aux:
+            indices += [variables.aux["xplus"], variables.aux["xminus"]]
+            values += [(weights > 0).astype(float), (weights < 0).astype(float)]
+        self.problem.set_mip_start(np.concatenate(indices), np.concatenate(values))
+
+    def solve(self):
+        """ Solve the model, starting from the previous solution if there is one """
+        if self.last_weights is not None:
+            self._set_mip_start()
+        status = self.problem.solve()
+        if status == mip.OPTIMAL:
+            self.last_weights = dict(zip(self.features[0], self.problem.get_values(self.variables.weights)))
+        return status
+
+
+def extract_heuristic_parameters_from_solution(problem, variables):
     """ Return a list of the tuples (i, w) that make up the potential heuristic, where i
     is the index of the feature and w is the learnt weight """
-    # Cplex sometimes returns float values even if the variable is declared as an integer
+    # Solvers sometimes return float values even if the variable is declared as an integer
     def make_weight_rounded(x):
         rounded_number = round(x,8)
         integer_number = int(round(x))
@@ -265,48 +430,41 @@ def extract_heuristic_parameters_from_cplex_solution(problem, nfeatures):
             return rounded_number
     #make_weight_rounded = lambda x: x
 
-    wvar_names = ((i, get_weight_var(i)) for i in range(0, nfeatures))
-    feature_weights = ((i, wname, make_weight_rounded(problem.solution.get_values(wname))) for i, wname in wvar_names)
-    nonzero_features = [(i, val) for i, var, val in feature_weights if val != 0]
+    values = problem.get_values(variables.weights)
+    feature_weights = ((i, make_weight_rounded(val)) for i, val in enumerate(values))
+    nonzero_features = [(i, val) for i, val in feature_weights if val != 0]
     return nonzero_features
 
 
-def create_toy_heuristic(features_per_state, parameters):
-    """ Create a toy heuristic that works only with the feature values that we have already precomputed
+def create_toy_heuristic(matrix, parameters):
+    """ Create a toy heuristic that works only with the feature values that we have already precomputed, on the
+    indices of the states in the given feature matrix.
     This will be useful e.g. for validation and debugging purposes.
     """
+    features = [f for f, _ in parameters]
+    weights = np.array([w for _, w in parameters], dtype=np.result_type(np.int64, *(w for _, w in parameters)))
+    values = (matrix[:, features] @ weights).tolist()
 
     def heuristic_function(s):
-        state_values = features_per_state[s]
-        h = 0
-        for ind, fweight in parameters:
-            h += fweight * state_values[ind]
-        return h
+        return values[s]
 
     return heuristic_function
 
 
-def report(parameters, heuristic, feature_names, feature_complexity, features_per_state, config):
+def report(parameters, heuristic, feature_names, feature_complexity, state_ids, config):
     print("Concept-based potential heuristic found with a total of {} features:".format(len(parameters)))
     for i, val in parameters:
         print("\t{weight} · {feature} [k={k}, id={id}]".format(weight=val,
                                                                feature=config.feature_namer(feature_names[i]),
                                                                k=feature_complexity[i], id=i))
 
-    sorted_state_ids = natural_sort(features_per_state.keys())
     with open(config.state_heuristic_filename, "w") as file:
-        for s in sorted_state_ids:
-            print("h({}) = {}".format(s, heuristic(s)), file=file)
+        for s in np.argsort(state_ids, kind="stable").tolist():
+            print("h(s{}) = {}".format(state_ids[s], heuristic(s)), file=file)
 
     # print("Weight Variables:")
     # print("\n".join("{}: {}".format(var, val) for var, val in var_vals))
 
-    # print("Y Variables:")
-    # y_variables = [get_y_var(t[0], t[1]) for t in transitions if t[0] not in goal_states]
-    # for i in y_variables:
-    #     print(i, '=', str(int(round(problem.solution.get_values(i)))) + ', ', end=' ')
-    # print()
-
     # print("X+- Variables:")
     # for f in range(0, len(feature_names)):
     #     print(f, str(
@@ -329,6 +487,11 @@ class ConceptBasedPotentialHeuristic:
 
         self.parameters = [(transform(feature), weight) for feature, weight in parameters]
 
+    def evaluate(self, feature_matrix):
+        """ Return the heuristic values of the rows of the given matrix with the denotations of the features """
+        weights = [weight for _, weight in self.parameters]
+        return feature_matrix @ np.array(weights, dtype=np.result_type(np.int64, *weights))
+
     def value(self, model):
         h = 0
         for feature, weight in self.parameters:
@@ -345,75 +508,113 @@ class ConceptBasedPotentialHeuristic:
 
 
 def run(config, data, rng):
-    max_weight = config.lp_max_weight
-
-    transitions, adj_list = read_transition_file(config.transitions_filename)
-    features_per_state, num_features = read_features_file(config.feature_matrix_filename)
-    goal_states = read_state_set(config.goal_states_filename)
-    unsolvable_states = read_state_set(config.unsolvable_states_filename)
+    return learn_weights(config, data, WeightMIP(config.mip_solver, config.lp_max_weight))
+
+
+def solve_lazily(model, sample, states, feature_names, feature_complexity, weight_scales=None):
+    """ Solve the WeightMIP, which contains the constraints of the given states of the sample only, adding the
+    constraints of the states in which the solution is violated until there are none. Every model solved is a
+    relaxation of the full model, so the first solution that satisfies all states is optimal for the full model. """
+    while True:
+        status = model.solve()
+        if status != mip.OPTIMAL:
+            return status
+        # States already in the model can only be violated within the tolerances of the solver
+        violated = np.setdiff1d(find_violated_states(sample, model.problem.get_values(model.variables.weights)),
+                                states)
+        if len(violated) == 0:
+            return status
+
+        logging.info("Solution violated in {} states, adding their constraints".format(len(violated)))
+        states = np.union1d(states, violated)
+        model.update(restrict_sample(sample, states), feature_names, feature_complexity, weight_scales)
+
+
+def learn_weights(config, data, model):
+    """ Learn the weights of the heuristic for the sample of the given config with the given WeightMIP, which
+    might already contain the constraints of a part of the sample """
+    state_ids, matrix = read_feature_matrix(config.feature_matrix_filename)
+    state_index = index_states(state_ids)
+    transitions = read_transitions(config.transitions_filename, state_index)
+    is_goal = read_state_flags(config.goal_states_filename, state_index)
+    is_unsolvable = read_state_flags(config.unsolvable_states_filename, state_index)
     feature_complexity, feature_names = read_complexity_file(config.feature_info_filename)
+    num_features = matrix.shape[1]
 
     logging.info("Read {} transitions, {} features, {} goal states".
-                 format(len(transitions), num_features, len(goal_states)))
+                 format(len(transitions[1]), num_features, np.count_nonzero(is_goal)))
 
     logging.info("Populating model")
-    problem = cplex.Cplex()
-    problem.objective.set_sense(problem.objective.sense.minimize)
-
-    logging.info("Populating objective function")
-
-    # See the code for options on obj function
-    populate_obj_function_min_complexity(problem, num_features, max_weight, transitions, feature_complexity, goal_states)
-    #populate_obj_function_max_nonselected_complexity(problem, num_features, max_weight, transitions, feature_complexity, goal_states)
-    logging.info("Populating weight constraints")
-    populate_weight_constraints(problem, transitions, features_per_state, goal_states, unsolvable_states)
-    logging.info("Populating dead-end constraints")
-    populate_dead_end_constraints(problem, transitions, features_per_state, goal_states, unsolvable_states)
-    logging.info("Populating y-constraints")
-    populate_y_constraints(problem, adj_list, goal_states, unsolvable_states)
-    logging.info("Populating M_w-constraints")
-
-    # This function requires the min weighted complexity obj function. Otherwise, use the max weight constraints
-    #populate_absolute_value_weight_constraints(problem, num_features, max_weight)
-    #populate_weight_selection_constraints(problem, num_features, max_weight)
-    populate_max_weight_constraints(problem, num_features, max_weight)
-
-    logging.info("Writing file...")
-    problem.write(config.lp_filename)
-    logging.info("Total number of constraints in the MIP: %d", problem.linear_constraints.get_num() + problem.indicator_constraints.get_num())
-    logging.info("Total number of variables in the MIP: %d", problem.variables.get_num())
-    logging.info("Solving MIP...")
-
-    # Below, some ways to limit resources. This allows suboptimal solutions (or no solution).
+    sample = index_sample(state_ids, matrix, transitions, is_goal, is_unsolvable)
+    features, scales = list(range(num_features)), None
+    if config.prune_redundant_features:
+        features, scales = find_nonredundant_features(sample.matrix, feature_complexity)
+        features = features.tolist()
+        logging.info("{} redundant features pruned, {} left".format(num_features - len(features), len(features)))
+        sample = select_features(sample, features)
+    # The model is built over the features left, the weight variable of features[i] being w_i
+    names = [feature_names[f] for f in features]
+    complexity = [feature_complexity[f] for f in features]
+
+    lazy = config.lp_lazy_constraints and mip.BACKENDS[config.mip_solver].can_solve
+    if lazy:
+        # Start with the constraints of the first states only, see solve_lazily
+        states = np.unique(sample.starts[~sample.is_unsolvable[sample.starts]])[:config.lp_lazy_initial_states]
+        model.update(restrict_sample(sample, states), names, complexity, scales)
+    else:
+        model.update(sample, names, complexity, scales)
+    problem = model.problem
+
+    if not lazy:
+        # In lazy mode, the file is only written once solved, with the constraints of all the states needed
+        logging.info("Writing file...")
+        problem.write(config.lp_filename)
+    logging.info("Total number of constraints in the MIP: %d", problem.num_constraints())
+    logging.info("Total number of variables in the MIP: %d", problem.num_variables())
+    if not problem.can_solve:
+        # Later steps need the learnt heuristic, so the pipeline cannot go on without solving the MIP
+        raise CriticalPipelineError("MIP written to '{}', to be solved with an external solver. The \"{}\" backend "
+                                    "cannot solve it, and no heuristic was learnt".format(config.lp_filename,
+                                                                                          config.mip_solver))
+
+    logging.info("Solving MIP with {}...".format(config.mip_solver))
+
+    # Below, some ways to limit resources with CPLEX. This allows suboptimal solutions (or no solution).
     # To set the timelimit:
-    # problem.parameters.timelimit.set(100)
+    # problem.problem.parameters.timelimit.set(100)
     # To set the limit of solutions found:
-    # problem.parameters.mip.limits.solutions.set(10)
+    # problem.problem.parameters.mip.limits.solutions.set(10)
     # To set high numerical precision on, turn on the following:
-    # problem.parameters.emphasis.numerical.set(1)
+    # problem.problem.parameters.emphasis.numerical.set(1)
 
-    problem.solve()
-    if problem.solution.is_primal_feasible() and problem.solution.is_dual_feasible():
-        logging.info("Optimal solution found with value {}".format(problem.solution.get_objective_value()))
+    if lazy:
+        status = solve_lazily(model, sample, states, names, complexity, scales)
+        logging.info("Writing file...")
+        problem.write(config.lp_filename)
+    else:
+        status = model.solve()
+    if status == mip.OPTIMAL:
+        logging.info("Optimal solution found with value {}".format(problem.get_objective_value()))
 
-        parameters = extract_heuristic_parameters_from_cplex_solution(problem, len(feature_names))
-        heuristic = create_toy_heuristic(features_per_state, parameters)
+        parameters = extract_heuristic_parameters_from_solution(problem, model.variables)
+        parameters = [(features[i], w) for i, w in parameters]  # Back to the indices of all features
+        heuristic = create_toy_heuristic(matrix, parameters)
 
-        report(parameters, heuristic, feature_names, feature_complexity, features_per_state, config)
+        report(parameters, heuristic, feature_names, feature_complexity, state_ids, config)
 
         if config.validate_learnt_heuristic and config.num_sampled_states is None:
             # Run hill-climbing and make sure we find a goal. This won't work if we only have a sample of the
             # transition system, as in the incremental approach, since we might not have sampled a path to the goal.
-            hill_climbing("s0", adj_list, heuristic, goal_states)
+            indptr, targets = transitions
+            adjacencies = [successors.tolist() for successors in np.split(targets, indptr[1:-1])]
+            hill_climbing(int(state_index[0]), adjacencies, heuristic, set(np.flatnonzero(is_goal).tolist()))
 
         # Return those values that we want to be persisted between different steps
         return ExitCode.Success, dict(learned_heuristic=create_potential_heuristic_from_parameters(
             data.features, parameters))
-    elif problem.solution.is_primal_feasible():
-        # TODO: if we limit the time or accept suboptimal solutions, we will
-        # fall in this case. Is it right? How can we avoid it?
+    elif status == mip.UNBOUNDED:
         logging.error("MIP is unbounded")
-    elif problem.solution.is_dual_feasible():
+    elif status == mip.INFEASIBLE:
         logging.error("MIP is unsolvable")
     else:
         logging.error("MIP was not solved. Unknown reason.")
@@ -1,14 +1,17 @@
+import importlib
 import json
+import logging
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
+from .mip import BACKENDS
 from .tester import compute_static_atoms
 from sltp.features import parse_pddl
 from sltp.returncodes import ExitCode
 
 from . import EXPDATA_DIR, PYPERPLAN_DIR
 from sltp.driver import Step, InvalidConfigParameter, check_int_parameter
-from sltp.util.command import execute, read_file
 from sltp.util.naming import compute_instance_tag, compute_experiment_tag, compute_sample_filename, \
     compute_info_filename
 
@@ -17,32 +20,68 @@ def compute_sample_filenames(experiment_dir, instances, **_):
     return [os.path.join(experiment_dir, compute_sample_filename(i, "0")) for i in instances]
 
 
-def _run_pyperplan(config, data, rng):
-    # Run the planner on all the instances
+def compute_binary_sample_filenames(sample_files, **_):
+    """ The binary samples are the canonical output of the sampling, and the json sample files next to them are
+    compatibility copies for the transition sampling step of sltp """
+    return [os.path.splitext(f)[0] + ".bin" for f in sample_files]
+
+
+def import_pyperplan_module(name):
+    """ Import the given pyperplan module. Pyperplan modules import each other as top-level modules, so
+    the pyperplan directory needs to be in the path while they are being imported. """
+    sys.path.insert(0, PYPERPLAN_DIR)
+    module = importlib.import_module(name)
+    sys.path = sys.path[1:]
+    return module
+
+
+# The samplers created within the current process, indexed by domain file, so that each domain is parsed only
+# once per process, also when sampling in a pool of worker processes
+_samplers = dict()
+
 
-    # config.num_states
+def _get_sampler(domain):
+    if domain not in _samplers:
+        sampler_module = import_pyperplan_module("state_space_sampler")
+        _samplers[domain] = sampler_module.StateSpaceSampler(domain)
+    return _samplers[domain]
 
-    for i, o in zip(config.instances, config.sample_files):
-        # params = '-i {} --domain {} --driver {} --disable-static-analysis --options="max_expansions={},width.max={}"'\
-        #     .format(i, config.domain, config.driver, config.num_states, w)
-        params = '-s full --state-space-output {} --max-nodes {} {} {}'.format(o, config.num_states, config.domain, i)
-        execute(command=[sys.executable, "pyperplan.py"] + params.split(' '), cwd=PYPERPLAN_DIR)
 
-        problem, _, _ = parse_pddl(config.domain, i)
-        static_atoms, static_predicates = compute_static_atoms(problem)
+def _sample_instance(domain, instance, sample_file, binary_sample_file, num_states):
+    """ Sample the state space of the given instance into the given binary sample file, and write a json copy of it
+    into the given sample file. The binary sample is the canonical one. """
+    binary_state_space = import_pyperplan_module("search.binary_state_space")
+    problem, _, _ = parse_pddl(domain, instance)
+    static_atoms, static_predicates = compute_static_atoms(problem)
+    assert all(len(static) > 0 for static in static_atoms)
 
-        all_states = []
-        # Extend pyperplan output with the necessary static predicates:
-        # read json output
-        for line in read_file(o):
-            state = json.loads(line)
-            assert all(len(static) > 0 for static in static_atoms)
-            state["atoms"] += ["{}({})".format(static[0], ','.join(static[1:])) for static in static_atoms]
-            all_states.append(state)
+    # The static atoms are stored only once per instance in the binary sample
+    _get_sampler(domain).sample_to_file(instance, binary_sample_file, max_nodes=num_states, static_atoms=[
+        "{}({})".format(static[0], ','.join(static[1:])) for static in static_atoms])
 
-        with open(o, "w") as f:
-            for s in all_states:
-                print(json.dumps(s), file=f)
+    # The json copy is only there because the transition sampling step of sltp reads the sample from it, in a later
+    # step of the pipeline, and expects one json-encoded entry per line with the static atoms in every state. It is
+    # translated from the binary sample in a single pass, and should go once sltp can read the binary sample.
+    with binary_state_space.BinaryStateSpace(binary_sample_file) as state_space, open(sample_file, "w") as f:
+        for entry in state_space.entries(with_static_atoms=True):
+            print(json.dumps(entry), file=f)
+    return sample_file
+
+
+def _run_pyperplan(config, data, rng):
+    # Sample all the instances, parsing the domain only once per process
+    jobs = [(config.domain, i, o, b, config.num_states)
+            for i, o, b in zip(config.instances, config.sample_files, config.binary_sample_files)]
+
+    if config.num_sampling_workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            logging.info("State space sample written to '{}'".format(_sample_instance(*job)))
+    else:
+        # Each instance is sampled into its own files, and the results are collected in the order of the instances,
+        # so the outcome does not depend on the order in which the workers finish.
+        with ProcessPoolExecutor(max_workers=min(config.num_sampling_workers, len(jobs))) as executor:
+            for sample_file in executor.map(_sample_instance, *zip(*jobs)):
+                logging.info("State space sample written to '{}'".format(sample_file))
 
     return ExitCode.Success, dict()
 
@@ -64,11 +103,14 @@ class PyperplanStep(Step):
         if not os.path.isfile(config["domain"]):
             raise InvalidConfigParameter('"domain" must be the path to an existing domain file')
         check_int_parameter(config, "num_states", positive=True)
+        config["num_sampling_workers"] = config.get("num_sampling_workers", 1)
+        check_int_parameter(config, "num_sampling_workers", positive=True)
 
         config["instance_tag"] = compute_instance_tag(**config)
         config["experiment_tag"] = compute_experiment_tag(**config)
         config["experiment_dir"] = os.path.join(EXPDATA_DIR, config["experiment_tag"][:64])
         config["sample_files"] = compute_sample_filenames(**config)
+        config["binary_sample_files"] = compute_binary_sample_filenames(**config)
 
         # TODO This should prob be somewhere else:
         os.makedirs(config["experiment_dir"], exist_ok=True)
@@ -82,6 +124,18 @@ class PyperplanStep(Step):
         return _run_pyperplan
 
 
+def process_weight_learning_config(config):
+    """ Set the default values of the parameters of the learning of the weights of the heuristic, and check them """
+    config["mip_solver"] = config.get("mip_solver", "cplex")
+    if config["mip_solver"] not in BACKENDS:
+        raise InvalidConfigParameter('"mip_solver" must be one of {}'.format(", ".join(sorted(BACKENDS))))
+    config["prune_redundant_features"] = config.get("prune_redundant_features", False)
+    config["lp_lazy_constraints"] = config.get("lp_lazy_constraints", False)
+    config["lp_lazy_initial_states"] = config.get("lp_lazy_initial_states", 100)
+    check_int_parameter(config, "lp_lazy_initial_states", positive=True)
+    return config
+
+
 class HeuristicWeightsLPComputation(Step):
     """  """
     def __init__(self, **kwargs):
@@ -92,7 +146,9 @@ class HeuristicWeightsLPComputation(Step):
                 "goal_states_filename", "feature_info_filename", "unsolvable_states_filename"]
 
     def process_config(self, config):
-        config["lp_filename"] = compute_info_filename(config, "problem.lp")
+        process_weight_learning_config(config)
+        extension = "mps" if config["mip_solver"] == "mps" else "lp"
+        config["lp_filename"] = compute_info_filename(config, "problem." + extension)
         config["state_heuristic_filename"] = compute_info_filename(config, "state-heuristic-values.txt")
 
         return config
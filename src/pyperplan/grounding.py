@@ -22,16 +22,15 @@ task.
 
 import logging
 import itertools
-import re
 from collections import defaultdict
 
-from task import Task, Operator
+from task import Task, Operator, SuccessorGenerator
 
 # controls mass log output
 verbose_logging = False
 
 
-def ground(problem):
+def ground(problem, reachability_analysis=True):
     """
     This is the main method that grounds the PDDL task and returns an
     instance of the task.Task class.
@@ -39,6 +38,11 @@ def ground(problem):
     @note Assumption: only PDDL problems with types at the moment.
 
     @param problem A pddl.Problem instance describing the parsed problem
+    @param reachability_analysis Whether to only ground the actions whose
+                                 preconditions are reachable from the initial
+                                 state in the delete relaxation, instead of
+                                 instantiating every action with all the
+                                 objects of the right types
     @return A task.Task instance with the grounded problem
     """
 
@@ -75,7 +79,11 @@ def ground(problem):
         logging.debug("Initial state with statics:\n%s" % init)
 
     # Ground actions
-    operators = _ground_actions(actions, type_map, statics, init)
+    if reachability_analysis:
+        operators = _ground_reachable_actions(actions, type_map, statics,
+                                              problem.initial_state, init)
+    else:
+        operators = _ground_actions(actions, type_map, statics, init)
     if verbose_logging:
         logging.debug('Operators:\n%s' % '\n'.join(map(str, operators)))
 
@@ -101,8 +109,14 @@ def ground(problem):
     # perform relevance analysis
     operators = _relevance_analysis(operators, goals)
 
+    # Grounding iterates over sets of objects, so sort the operators to make
+    # their order, and with it the order in which successors are generated,
+    # independent of the hash seed of the process
+    operators.sort(key=lambda op: op.name)
+
     name = problem.name
-    return Task(name, facts, init, goals, operators)
+    return Task(name, facts, init, goals, operators,
+                SuccessorGenerator(operators))
 
 
 def _relevance_analysis(operators, goals):
@@ -226,47 +240,206 @@ def _ground_actions(actions, type_map, statics, init):
     @param statics: Names of the static predicates
     @param init: Grounded initial state
     """
-    op_lists = [_ground_action(action, type_map, statics, init)
+    static_index = _index_atoms(atom for atom in map(_parse_fact, init)
+                                if atom[0] in statics)
+    op_lists = [_ground_action(action, type_map, statics, init, static_index)
                 for action in actions]
     operators = list(itertools.chain(*op_lists))
     return operators
 
 
-def _find_pred_in_init(pred_name, param, sig_pos, init):
+def _ground_reachable_actions(actions, type_map, statics, initial_atoms, init):
     """
-    This method is used to check whether an instantiation of the predicate
-    denoted by pred_name with the parameter param at position sig_pos is
-    present in the initial condition.
+    Ground the actions whose preconditions are reachable from the initial
+    state when delete effects are ignored, and return the resulting list of
+    operators.
+
+    The reachable atoms are computed with a fixpoint: the assignments of an
+    action are found by joining the extensions of its precondition
+    predicates along the shared parameters, and the add effects of every new
+    operator extend these predicates. In each round after the first, only
+    the assignments that use at least one atom reached in the previous
+    round are computed.
 
-    Useful to evaluate static preconditions efficiently.
+    @param actions: List of actions
+    @param type_map: Mapping from type to objects of that type
+    @param statics: Names of the static predicates
+    @param initial_atoms: The atoms of the initial state (pddl.Predicate)
+    @param init: Grounded initial state
     """
-    match_init = None
-    if sig_pos == 0:
-        match_init = re.compile('\(%s %s.*' % (pred_name, param))
-    else:
-        reg_ex = '\(%s\s+' % pred_name
-        reg_ex += '[\w\d-]+\s+' * sig_pos
-#        for i in xrange(sig_pos):
-#            reg_ex += '[\w\d-]+\s+'
-        reg_ex += '%s.*' % param
-        match_init = re.compile(reg_ex)
-    assert (match_init is not None)
-    return any([match_init.match(string) for string in init])
+    # predicate name -> set of argument tuples reached so far
+    reached = defaultdict(set)
+    for atom in initial_atoms:
+        reached[atom.name].add(tuple(name for name, _ in atom.signature))
+    index = _index_atoms((name, args) for name, atoms in reached.items()
+                         for args in atoms)
+    # the atoms reached in the previous round
+    new_atoms = {name: set(args) for name, args in reached.items()}
+
+    param_to_objects = {action: _get_param_to_objects(action, type_map)
+                        for action in actions}
+    grounded = {action: set() for action in actions}
+    operators = []
+    first_round = True
+    while new_atoms:
+        previous_atoms, new_atoms = new_atoms, defaultdict(set)
+        for action in actions:
+            if first_round:
+                seeds = [None]
+            else:
+                seeds = [i for i, pre in enumerate(action.precondition)
+                         if pre.name not in statics and
+                         previous_atoms.get(pre.name)]
+            for seed in seeds:
+                for assignment in _join_preconditions(
+                        action, param_to_objects[action], reached, index,
+                        previous_atoms, seed):
+                    args = tuple(assignment[name] for name, _ in
+                                 action.signature)
+                    if args in grounded[action]:
+                        continue
+                    grounded[action].add(args)
+                    op = _create_operator(action, assignment, statics, init)
+                    if op is None:
+                        continue
+                    operators.append(op)
+                    for effect in action.effect.addlist:
+                        effect_args = tuple(assignment.get(name, name) for
+                                            name, _ in effect.signature)
+                        if effect_args not in reached[effect.name]:
+                            new_atoms[effect.name].add(effect_args)
+        for name, atoms in new_atoms.items():
+            reached[name] |= atoms
+            for args in atoms:
+                _add_to_index(index, name, args)
+        first_round = False
+    return operators
 
 
-def _ground_action(action, type_map, statics, init):
+def _join_preconditions(action, param_to_objects, reached, atom_index,
+                        new_atoms, seed):
     """
-    Ground the action and return the resulting list of operators.
+    Yield the assignments of the parameters of "action" for which all
+    preconditions are in "reached", whose atoms are indexed in "atom_index"
+    as returned by _index_atoms. If "seed" is not None, the precondition with
+    this index has to be matched by one of the "new_atoms".
+    Parameters that do not occur in any precondition are assigned all the
+    objects of their types.
     """
-    logging.debug('Grounding %s' % action.name)
-    param_to_objects = {}
+    remaining = list(action.precondition)
+    preconditions = [] if seed is None else [remaining.pop(seed)]
+    # Join the preconditions that share most parameters with the ones
+    # joined before first, to keep the intermediate results small
+    bound = {var for pre in preconditions for var, _ in pre.signature}
+    while remaining:
+        pre = max(remaining, key=lambda pre: sum(
+            var in bound for var, _ in pre.signature))
+        remaining.remove(pre)
+        preconditions.append(pre)
+        bound.update(var for var, _ in pre.signature)
+
+    def extend(index, assignment):
+        if index == len(preconditions):
+            yield assignment
+            return
+        pre = preconditions[index]
+        if index == 0 and seed is not None:
+            atoms = new_atoms.get(pre.name, ())
+        else:
+            atoms = _lookup_atoms(pre, assignment, param_to_objects,
+                                  reached, atom_index)
+        for args in atoms:
+            if len(args) != len(pre.signature):
+                continue
+            extended = dict(assignment)
+            for (name, _), obj in zip(pre.signature, args):
+                if name in param_to_objects:
+                    if extended.setdefault(name, obj) != obj or \
+                            obj not in param_to_objects[name]:
+                        break
+                elif name != obj:
+                    # a constant that does not match
+                    break
+            else:
+                yield from extend(index + 1, extended)
+
+    free_params = [name for name in param_to_objects if not any(
+        name == var for pre in preconditions for var, _ in pre.signature)]
+    domain_lists = [[(name, obj) for obj in param_to_objects[name]]
+                    for name in free_params]
+    for assignment in extend(0, dict()):
+        for free_assignment in itertools.product(*domain_lists):
+            full_assignment = dict(assignment)
+            full_assignment.update(free_assignment)
+            yield full_assignment
+
+
+def _lookup_atoms(atom, assignment, param_to_objects, reached, index):
+    """
+    Return the reached argument tuples of the predicate of "atom" that can
+    match it under "assignment". If an argument of the atom is a constant or
+    an assigned parameter, only the tuples with this object at its position
+    are looked up in the index.
+    """
+    for position, (name, _) in enumerate(atom.signature):
+        obj = assignment.get(name) if name in param_to_objects else name
+        if obj is not None:
+            return index.get((atom.name, position), {}).get(obj, ())
+    return reached.get(atom.name, ())
+
+
+def _index_atoms(atoms):
+    """
+    Index ground atoms given as (predicate name, argument tuple) pairs.
+
+    @return A dictionary mapping (predicate name, argument position) to a
+            dictionary from each object to the set of argument tuples with
+            this object at this position
+    """
+    index = defaultdict(lambda: defaultdict(set))
+    for name, args in atoms:
+        _add_to_index(index, name, args)
+    return index
+
 
+def _add_to_index(index, name, args):
+    for position, obj in enumerate(args):
+        index[name, position][obj].add(args)
+
+
+def _parse_fact(fact):
+    """
+    Return the (predicate name, argument tuple) pair of a fact in the
+    notation of _get_grounded_string.
+    """
+    name, *args = fact[1:-1].split()
+    return name, tuple(args)
+
+
+def _get_param_to_objects(action, type_map):
+    """
+    Return a mapping from each parameter of "action" to the set of objects
+    of its types.
+    """
+    param_to_objects = {}
     for param_name, param_types in action.signature:
         # List of sets of objects for this parameter
         objects = [type_map[type] for type in param_types]
         # Combine the sets into one set
         objects = set(itertools.chain(*objects))
         param_to_objects[param_name] = objects
+    return param_to_objects
+
+
+def _ground_action(action, type_map, statics, init, static_index):
+    """
+    Ground the action and return the resulting list of operators.
+
+    @param static_index: The static atoms of the initial state, indexed with
+                         _index_atoms
+    """
+    logging.debug('Grounding %s' % action.name)
+    param_to_objects = _get_param_to_objects(action, type_map)
 
     # For each parameter that is not constant,
     # remove all invalid static preconditions
@@ -284,9 +457,14 @@ def _ground_action(action, type_map, statics, init):
                     count += 1
                 if sig_pos != -1:
                     # remove if no instantiation present in initial state
+                    # that agrees with the objects left for the other
+                    # arguments
+                    table = static_index.get((pred.name, sig_pos), {})
                     obj_copy = objects.copy()
                     for o in obj_copy:
-                        if not _find_pred_in_init(pred.name, o, sig_pos, init):
+                        if not any(_static_args_match(pred, args,
+                                                      param_to_objects)
+                                   for args in table.get(o, ())):
                             if verbose_logging:
                                 remove_debug += 1
                             objects.remove(o)
@@ -309,6 +487,22 @@ def _ground_action(action, type_map, statics, init):
     return ops
 
 
+def _static_args_match(pred, args, param_to_objects):
+    """
+    Check whether the argument tuple "args" of a static atom can instantiate
+    the precondition "pred" with the objects left for the parameters.
+    """
+    if len(args) != len(pred.signature):
+        return False
+    for (name, _), obj in zip(pred.signature, args):
+        if name in param_to_objects:
+            if obj not in param_to_objects[name]:
+                return False
+        elif name != obj:
+            return False
+    return True
+
+
 def _create_operator(action, assignment, statics, init):
     """Create an operator for "action" and "assignment".
 
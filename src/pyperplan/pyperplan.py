@@ -37,8 +37,10 @@ except ImportError:
 from pddl.parser import Parser
 import grounding
 import search
+from search import StateSpaceWriter, BinaryStateSpaceWriter
 import heuristics
 import tools
+from task import BitsetTask, StateDecodingHeuristic
 
 SEARCHES = {
     'astar': search.astar_search,
@@ -137,7 +139,8 @@ def _ground(problem):
     return task
 
 
-def _search(task, search, heuristic, search_name, max_nodes=INFINITY, use_preferred_ops=False):
+def _search(task, search, heuristic, search_name, max_nodes=INFINITY, use_preferred_ops=False,
+            early_duplicate_detection=False, state_space_writer=None):
     logging.info('Search start: {0}'.format(task.name))
     if heuristic:
         if use_preferred_ops:
@@ -146,7 +149,8 @@ def _search(task, search, heuristic, search_name, max_nodes=INFINITY, use_prefer
             solution = search(task, heuristic)
     else:
         if search_name == "full":
-            solution = search(task, max_nodes)
+            solution = search(task, max_nodes, early_duplicate_detection=early_duplicate_detection,
+                              writer=state_space_writer)
         else:
             solution = search(task)
     logging.info('Search end: {0}'.format(task.name))
@@ -161,7 +165,8 @@ def _write_solution(solution, filename):
 
 
 def search_plan(domain_file, problem_file, search, heuristic_class, search_name,
-                use_preferred_ops=False, max_nodes=INFINITY):
+                use_preferred_ops=False, max_nodes=INFINITY, early_duplicate_detection=False,
+                state_space_writer=None, bitset_states=False):
     """
     Parses the given input files to a specific planner task and then tries to
     find a solution using the specified  search algorithm and heuristics.
@@ -173,6 +178,8 @@ def search_plan(domain_file, problem_file, search, heuristic_class, search_name,
                             search space
     @param heuristic_class  A class implementing the heuristic_base.Heuristic
                             interface
+    @param bitset_states    Whether to search on a task.BitsetTask, whose
+                            states are represented as ints
     @return A list of actions that solve the problem
     """
     problem = _parse(domain_file, problem_file)
@@ -181,11 +188,19 @@ def search_plan(domain_file, problem_file, search, heuristic_class, search_name,
 
     if not heuristic_class is None:
         heuristic = heuristic_class(task)
+    use_preferred_ops = use_preferred_ops and isinstance(heuristic, heuristics.hFFHeuristic)
+
+    if bitset_states:
+        task = BitsetTask(task)
+        if heuristic is not None:
+            heuristic = StateDecodingHeuristic(heuristic, task)
     search_start_time = time.clock()
 
     if search_name == "full":
-        solution = _search(task, search, heuristic, search_name, max_nodes=max_nodes)
-    elif use_preferred_ops and isinstance(heuristic, heuristics.hFFHeuristic):
+        solution = _search(task, search, heuristic, search_name, max_nodes=max_nodes,
+                           early_duplicate_detection=early_duplicate_detection,
+                           state_space_writer=state_space_writer)
+    elif use_preferred_ops:
         solution = _search(task, search, heuristic, search_name, use_preferred_ops=True)
     else:
         solution = _search(task, search, heuristic, search_name)
@@ -239,6 +254,19 @@ def parse_args(argv):
     argparser.add_argument('--state-space-output',
                            help='File name to output the state space explored.',
                            default='state_space.json')
+    argparser.add_argument('--early-duplicate-detection', action='store_true',
+                           help='In the full state space search, detect duplicates when '
+                                'generating successors instead of when expanding them')
+    argparser.add_argument('--state-space-format', choices=['json', 'stream', 'binary'],
+                           help='Format of the state space output: "json" writes one '
+                                'entry per transition once the search is over, "stream" '
+                                'writes states and transitions as they are discovered, '
+                                '"binary" writes them in the compact format of '
+                                'search/binary_state_space.py',
+                           default='json')
+    argparser.add_argument('--bitset-states', action='store_true',
+                           help='Represent states as bitsets over the facts of '
+                                'the task during search (not supported by sat)')
     args = argparser.parse_args(argv)
     if args.max_nodes == "INFINITY":
         args.max_nodes = INFINITY
@@ -248,6 +276,10 @@ def parse_args(argv):
               hffpo_searches, file=sys.stderr)
         argparser.print_help()
         exit(2)
+    if args.bitset_states and args.search == 'sat':
+        print('ERROR: sat cannot be used with --bitset-states\n', file=sys.stderr)
+        argparser.print_help()
+        exit(2)
 
     return args
 
@@ -276,10 +308,26 @@ def main(args):
     logging.info('using heuristic: %s' % (heuristic.__name__ if heuristic
                                           else None))
     use_preferred_ops = (args.heuristic == 'hffpo')
+
+    if args.search == "full" and args.state_space_format in ("stream", "binary"):
+        logging.info("Streaming state space to \'" + args.state_space_output + "'.")
+        binary = args.state_space_format == "binary"
+        with open(args.state_space_output, 'wb' if binary else 'w') as outfile:
+            writer = BinaryStateSpaceWriter(outfile) if binary else StateSpaceWriter(outfile)
+            search_plan(args.domain, args.problem, search, heuristic,
+                        args.search,
+                        max_nodes=float(args.max_nodes),
+                        early_duplicate_detection=args.early_duplicate_detection,
+                        state_space_writer=writer,
+                        bitset_states=args.bitset_states)
+        sys.exit()
+
     solution = search_plan(args.domain, args.problem, search, heuristic,
                            args.search,
                            use_preferred_ops=use_preferred_ops,
-                           max_nodes=float(args.max_nodes))
+                           max_nodes=float(args.max_nodes),
+                           early_duplicate_detection=args.early_duplicate_detection,
+                           bitset_states=args.bitset_states)
 
     if args.search == "full":
         logging.info("Writing state space on \'" + args.state_space_output + "'.")
@@ -20,6 +20,7 @@ from .breadth_first_search import breadth_first_search
 from .enforced_hillclimbing_search import enforced_hillclimbing_search
 from .iterative_deepening_search import iterative_deepening_search
 from .sat import sat_solve
-from .full_state_space_search import full_state_space_search
+from .full_state_space_search import full_state_space_search, StateSpaceWriter, read_state_space_stream
+from .binary_state_space import BinaryStateSpaceWriter, BinaryStateSpace
 
 from .searchspace import make_root_node, make_child_node
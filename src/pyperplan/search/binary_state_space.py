@@ -0,0 +1,258 @@
+#
+# This file is part of pyperplan.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Compact binary representation of an explored state space.
+
+The file consists of the following sections, all little-endian and aligned to
+8 bytes:
+
+    states      num_states bitsets of state_bytes bytes each. Bit i of a
+                state is set iff atom i of the atom table is true in it.
+    flags       one byte per state: bit 0 is set for goal states, bit 1 for
+                unsolvable states.
+    offsets     num_states + 1 uint32 values, the CSR row offsets into
+                "parents".
+    parents     num_transitions uint32 values: the parents of state i are
+                parents[offsets[i]:offsets[i + 1]], in the order in which the
+                transitions were generated.
+    footer      a JSON object with the atom table, the static atoms of the
+                instance, the section sizes and their byte offsets.
+    trailer     the byte offset of the footer as an uint64, followed by the
+                magic string.
+
+States are written as they are discovered, so that the file can be produced
+while the search is running. The footer is written last, which also allows
+updating the static atoms of an instance without rewriting the whole file.
+"""
+
+from array import array
+import json
+import mmap
+import struct
+
+
+MAGIC = b'PPSS'
+VERSION = 1
+GOAL_FLAG = 1
+UNSOLVABLE_FLAG = 2
+
+_TRAILER = struct.Struct('<Q4s')
+
+
+def _padding(position):
+    return b'\0' * (-position % 8)
+
+
+def _to_little_endian(values):
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class BinaryStateSpaceWriter:
+    """
+    Writes the state space to a binary stream in the format described above.
+    Implements the same interface as full_state_space_search.StateSpaceWriter.
+    """
+    def __init__(self, stream, static_atoms=()):
+        self.stream = stream
+        self.static_atoms = list(static_atoms)
+        self.atoms = None
+        self.atom_index = None
+        self.state_bytes = 0
+        self.position = 0
+        self.flags = bytearray()
+        self.transition_parents = array('I')
+        self.transition_children = array('I')
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+    def begin(self, atoms):
+        """ Set the table of atoms that can appear in the states """
+        self.atoms = list(atoms)
+        self.atom_index = {atom: i for i, atom in enumerate(self.atoms)}
+        self.state_bytes = (len(self.atoms) + 7) // 8
+
+    def write_state(self, state_id, atoms, is_goal):
+        assert self.atoms is not None, "begin() must be called before writing any state"
+        assert state_id == len(self.flags), "States must be written in order of their ids"
+        bits = 0
+        for atom in atoms:
+            bits |= 1 << self.atom_index[atom]
+        self._write(bits.to_bytes(self.state_bytes, 'little'))
+        self.flags.append(GOAL_FLAG if is_goal else 0)
+
+    def write_transition(self, parent_id, state_id):
+        self.transition_parents.append(parent_id)
+        self.transition_children.append(state_id)
+
+    def write_unsolvable(self, state_ids):
+        """ Mark the given states as unsolvable and write the remaining sections """
+        for state_id in state_ids:
+            self.flags[state_id] |= UNSOLVABLE_FLAG
+        num_states = len(self.flags)
+        sections = dict()
+
+        self._write(_padding(self.position))
+        sections["flags"] = self.position
+        self._write(bytes(self.flags))
+
+        # Sort the transitions by child with a counting sort, which keeps them
+        # in generation order for each child
+        offsets = array('I', [0] * (num_states + 1))
+        for child in self.transition_children:
+            offsets[child + 1] += 1
+        for i in range(num_states):
+            offsets[i + 1] += offsets[i]
+        parents = array('I', [0] * len(self.transition_parents))
+        position = array('I', offsets[:-1])
+        for parent, child in zip(self.transition_parents, self.transition_children):
+            parents[position[child]] = parent
+            position[child] += 1
+
+        self._write(_padding(self.position))
+        sections["offsets"] = self.position
+        self._write(_to_little_endian(offsets))
+        self._write(_padding(self.position))
+        sections["parents"] = self.position
+        self._write(_to_little_endian(parents))
+
+        self._write(_padding(self.position))
+        _write_footer(self.stream, self.position, dict(
+            version=VERSION, atoms=self.atoms, static_atoms=self.static_atoms, num_states=num_states,
+            num_transitions=len(parents), state_bytes=self.state_bytes, sections=sections))
+
+
+def _write_footer(stream, position, footer):
+    stream.write(json.dumps(footer).encode('utf-8'))
+    stream.write(_TRAILER.pack(position, MAGIC))
+
+
+def _read_footer(buffer):
+    footer_position, magic = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size)
+    if magic != MAGIC:
+        raise ValueError('Not a binary state space file')
+    footer = json.loads(bytes(buffer[footer_position:len(buffer) - _TRAILER.size]).decode('utf-8'))
+    if footer["version"] != VERSION:
+        raise ValueError('Unsupported binary state space version {}'.format(footer["version"]))
+    return footer_position, footer
+
+
+def set_static_atoms(filename, static_atoms):
+    """ Replace the static atoms stored in the given file, rewriting only its footer """
+    with open(filename, 'r+b') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            footer_position, footer = _read_footer(buffer)
+        footer["static_atoms"] = list(static_atoms)
+        file.seek(footer_position)
+        file.truncate()
+        _write_footer(file, footer_position, footer)
+
+
+class BinaryStateSpace:
+    """
+    Read-only view of a binary state space file. The file is memory-mapped, and
+    states are only decoded when accessed.
+    """
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, footer = _read_footer(self._buffer)
+        self.atoms = footer["atoms"]
+        self.static_atoms = footer["static_atoms"]
+        self.num_states = footer["num_states"]
+        self.num_transitions = footer["num_transitions"]
+        self.state_bytes = footer["state_bytes"]
+        sections = footer["sections"]
+
+        view = memoryview(self._buffer)
+        self.flags = view[sections["flags"]:sections["flags"] + self.num_states]
+        self.offsets = self._uint32_view(view, sections["offsets"], self.num_states + 1)
+        self.parents = self._uint32_view(view, sections["parents"], self.num_transitions)
+        self._states = view[:self.num_states * self.state_bytes]
+
+    @staticmethod
+    def _uint32_view(view, start, length):
+        section = view[start:start + 4 * length]
+        if struct.pack('=I', 1) != struct.pack('<I', 1):
+            values = array('I', section)
+            values.byteswap()
+            return values
+        return section.cast('I')
+
+    def close(self):
+        for view in (self.flags, self.offsets, self.parents, self._states):
+            if isinstance(view, memoryview):
+                view.release()
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.num_states
+
+    def state_bits(self, state_id):
+        start = state_id * self.state_bytes
+        return int.from_bytes(self._states[start:start + self.state_bytes], 'little')
+
+    def atom_ids(self, state_id):
+        """ Return the indices in the atom table of the atoms true in the given state """
+        bits = self.state_bits(state_id)
+        ids = []
+        while bits:
+            lowest = bits & -bits
+            ids.append(lowest.bit_length() - 1)
+            bits ^= lowest
+        return ids
+
+    def state_atoms(self, state_id):
+        return [self.atoms[i] for i in self.atom_ids(state_id)]
+
+    def is_goal(self, state_id):
+        return bool(self.flags[state_id] & GOAL_FLAG)
+
+    def is_unsolvable(self, state_id):
+        return bool(self.flags[state_id] & UNSOLVABLE_FLAG)
+
+    def state_parents(self, state_id):
+        return self.parents[self.offsets[state_id]:self.offsets[state_id + 1]]
+
+    def entries(self, with_static_atoms=False):
+        """
+        Yield, in order, the same (state, parent) entries that
+        StateSpaceInfo.convert_to_json returns. If with_static_atoms is True,
+        the static atoms of the instance are appended to the atoms of every
+        entry.
+        """
+        static_atoms = self.static_atoms if with_static_atoms else []
+        for state_id in range(self.num_states):
+            atoms = self.state_atoms(state_id) + static_atoms
+            goal = self.is_goal(state_id)
+            unsolvable = self.is_unsolvable(state_id)
+            # the root is its own parent
+            parents = ([0] if state_id == 0 else []) + list(self.state_parents(state_id))
+            for parent in parents:
+                yield dict(id=state_id, parent=parent, goal=goal, unsolvable=unsolvable, atoms=atoms)
@@ -20,12 +20,93 @@ Implements a complete search until a given limit of expansions.
 """
 
 from collections import deque
+import json
 import logging
 
 
 from . import searchspace
 
 
+def parse_atom(atom):
+    """ Translate a pyperplan atom such as "(at b1 r1)" into "at(b1,r1)" """
+    atom = atom.replace('(', '')
+    atom = atom.replace(')', '')
+    split = atom.split()
+    action = split[0]
+    new_atom = action+"(" + (",".join(split[1:])) + ")"
+    return new_atom
+
+
+class StateSpaceWriter:
+    """
+    Streams the state space to a file while it is being explored, one JSON
+    object per line. Each state is written once, when it is discovered,
+    together with its atoms; transitions are written separately, as pairs of
+    state ids:
+
+        {"state": 3, "goal": false, "atoms": [...]}
+        {"transition": [0, 3]}
+
+    The ids of the unsolvable states are only known once the search is over,
+    and are written in a last line:
+
+        {"unsolvable": [...]}
+
+    Use read_state_space_stream to translate such a file back into the
+    entries produced by StateSpaceInfo.convert_to_json.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def begin(self, atoms):
+        """ Called once before the search with all atoms that can appear in a state """
+
+    def _write(self, entry):
+        print(json.dumps(entry), file=self.stream)
+
+    def write_state(self, state_id, atoms, is_goal):
+        self._write({"state": state_id, "goal": is_goal, "atoms": atoms})
+
+    def write_transition(self, parent_id, state_id):
+        self._write({"transition": [parent_id, state_id]})
+
+    def write_unsolvable(self, state_ids):
+        self._write({"unsolvable": state_ids})
+
+
+def read_state_space_stream(filename):
+    """
+    Read a state space written by a StateSpaceWriter and yield, in order, the
+    same (state, parent) entries that StateSpaceInfo.convert_to_json returns.
+
+    The file is read twice, so that only the transitions and not the atoms of
+    all states need to be kept in memory.
+    """
+    parents = []
+    unsolvable = set()
+    with open(filename, 'r') as file:
+        for line in file:
+            entry = json.loads(line)
+            if "state" in entry:
+                # the root is its own parent
+                parents.append([0] if entry["state"] == 0 else [])
+            elif "transition" in entry:
+                parent_id, state_id = entry["transition"]
+                parents[state_id].append(parent_id)
+            else:
+                unsolvable.update(entry["unsolvable"])
+
+    with open(filename, 'r') as file:
+        for line in file:
+            entry = json.loads(line)
+            if "state" not in entry:
+                continue
+            state_id = entry["state"]
+            for parent in parents[state_id]:
+                yield dict(id=state_id, parent=parent, goal=entry["goal"],
+                           unsolvable=state_id in unsolvable, atoms=entry["atoms"])
+
+
 class StateSpaceInfo:
     """
     Auxiliary class just to keep track of the transitions and
@@ -33,68 +114,115 @@ class StateSpaceInfo:
     Similar to the searchspace.py classes, but used only
     for our purposes.
 
-    NOTE: the data structure used during the search is different from the one
-    printed and used later, we might be able to make it the same
-
+    States are interned: each distinct state gets a consecutive integer id
+    the first time it is seen, and all other information (parents, goal and
+    solvability flags) is kept in lists indexed by that id, so that all
+    lookups are constant-time.
     """
 
-    def __init__(self):
-        self.states = dict()
-        self.global_id = 0
+    def __init__(self, writer=None, facts_of=None):
+        # optional StateSpaceWriter to which states and transitions are
+        # streamed as soon as they are discovered
+        self.writer = writer
+        # translates a state into the set of facts true in it, for tasks
+        # whose states are not sets of facts
+        self.facts_of = facts_of or (lambda state: state)
+        # state -> id
+        self.ids = dict()
+        # id -> state, parent ids, goal flag, unsolvable flag
+        self.states = []
+        self.parents = []
+        self.is_goal = []
+        self.unsolvable = []
         self.goals = []
 
+    def _intern(self, state, is_goal):
+        """
+        Return the id of the given state, registering it if it has not been
+        seen before.
+        """
+        state_id = self.ids.get(state)
+        if state_id is None:
+            state_id = len(self.states)
+            self.ids[state] = state_id
+            self.states.append(state)
+            self.parents.append([])
+            self.is_goal.append(is_goal)
+            self.unsolvable.append(not is_goal)
+            if self.writer is not None:
+                self.writer.write_state(state_id, [self.parse_atom(atom) for atom in self.facts_of(state)],
+                                        is_goal)
+        return state_id
+
     """
     Add a state to the state space information
 
     @param state: state from the SearchNode class
     @param parent: parent from the SearchNode class
+    @param is_goal: whether the state is a goal state
     """
     def add_state(self, state, parent, is_goal):
         # corner case for initial state
         if parent is None:
-            self.states[state] = (self.global_id, [0], is_goal, (not is_goal))
-            self.global_id += 1
+            state_id = self._intern(state, is_goal)
+            self.parents[state_id].append(0)
             return
-        if state in list(self.states.keys()):
-            state_id, parents_list, is_goal, unsolvable = self.states[state]
-            parents_list.append(self.get_id(parent.state))
-            self.states[state] = (state_id, parents_list, is_goal, unsolvable)
-        else:
-            self.states[state] = (self.global_id, [self.get_id(parent.state)], is_goal, (not is_goal))
-            self.global_id += 1
+        self.add_transition(self.ids[parent.state], state, is_goal)
+
+    def add_transition(self, parent_id, state, is_goal):
+        """
+        Record the transition from the state with id parent_id to the given
+        state, and return the id of the latter.
+        """
+        state_id = self._intern(state, is_goal)
+        self.parents[state_id].append(parent_id)
+        if self.writer is not None:
+            self.writer.write_transition(parent_id, state_id)
 
         if is_goal:
-            self.goals.append(self.get_id(state))
+            self.goals.append(state_id)
+        return state_id
 
     def get_id(self, state):
-        state_id, _, _, _ = self.states[state]
-        return state_id
+        return self.ids[state]
+
+    def find_id(self, state):
+        """ Return the id of the given state, or None if it is not known yet """
+        return self.ids.get(state)
 
     def get_state_from_id(self, id):
-        for s in self.states:
-            if self.states[s][0] == id:
-                return s
+        return self.states[id]
 
     def _debug_print(self):
-        for i in self.states:
-            print (i, self.states[i])
+        for state_id, state in enumerate(self.states):
+            print(state, (state_id, self.parents[state_id], self.is_goal[state_id], self.unsolvable[state_id]))
 
     def parse_atom(self, atom):
-        atom = atom.replace('(', '')
-        atom = atom.replace(')', '')
-        split = atom.split()
-        action = split[0]
-        new_atom = action+"(" + (",".join(split[1:])) + ")"
-        return new_atom
+        return parse_atom(atom)
+
+    def finish(self):
+        """
+        Complete the state space information once the search is over.
+
+        @return: the state space as a list of JSON entries or, if the state
+                 space is being streamed, None after writing the ids of the
+                 unsolvable states.
+        """
+        if self.writer is None:
+            return self.convert_to_json()
+        self.update_unsolvable_nodes()
+        self.writer.write_unsolvable([state_id for state_id, unsolvable in enumerate(self.unsolvable)
+                                      if unsolvable])
+        return None
 
     def convert_to_json(self):
         self.update_unsolvable_nodes()
         output = []
-        # print(self.states)
-        for state in self.states:
-            state_id, parents, is_goal, unsolvable = self.states[state]
-            atoms = [self.parse_atom(atom) for atom in state]
-            for parent in parents:
+        for state_id, state in enumerate(self.states):
+            atoms = [self.parse_atom(atom) for atom in self.facts_of(state)]
+            is_goal = self.is_goal[state_id]
+            unsolvable = self.unsolvable[state_id]
+            for parent in self.parents[state_id]:
                 new_entry = dict()
                 new_entry["id"] = state_id
                 new_entry["parent"] = parent
@@ -108,27 +236,44 @@ class StateSpaceInfo:
         '''
         Check which nodes are actually unsolvable or not using a backward search from the goal
         '''
-        while (len(self.goals) > 0):
-            node = self.goals.pop(0)
-            state = self.get_state_from_id(node)
-            state_id, parents, _, _ = self.states[state]
-            for parent in parents:
-                parent_state = self.get_state_from_id(parent)
-                parent_id, predecessors, is_goal, unsolvable = self.states[parent_state]
-                if not unsolvable:
-                    # it means that it is already in the list or it was already
+        queue = deque(self.goals)
+        self.goals = []
+        unsolvable = self.unsolvable
+        while queue:
+            node = queue.popleft()
+            for parent in self.parents[node]:
+                if not unsolvable[parent]:
+                    # it means that it is already in the queue or it was already
                     # expanded backwards
                     continue
-                else:
-                    unsolvable = False
-                    self.goals.append(parent_id)
-                    self.states[parent_state] = (parent_id, predecessors, is_goal, unsolvable)
+                unsolvable[parent] = False
+                queue.append(parent)
 
 
-def full_state_space_search(planning_task, max_exp):
+def _create_state_space_info(planning_task, writer):
+    if writer is not None:
+        writer.begin(sorted(parse_atom(fact) for fact in planning_task.facts))
+    return StateSpaceInfo(writer, planning_task.facts_of)
+
+
+def full_state_space_search(planning_task, max_exp, early_duplicate_detection=False, writer=None):
+    """
+    Expand the state space of the task in breadth-first order until max_exp
+    states have been expanded.
+
+    @param early_duplicate_detection: If True, transitions are recorded and
+                                      duplicates discarded when successors are
+                                      generated, so that the open list holds
+                                      each state only once. The resulting
+                                      state space is the same.
+    @param writer: If given, a StateSpaceWriter to which the state space is
+                   streamed during the search. None is returned in that case.
+    """
+    if early_duplicate_detection:
+        return _full_state_space_search_early_dd(planning_task, max_exp, writer)
 
     # create obj to track state space
-    state_space = StateSpaceInfo()
+    state_space = _create_state_space_info(planning_task, writer)
 
     # counts the number of loops (only for printing) and goal states found
     iteration = 0
@@ -168,7 +313,7 @@ def full_state_space_search(planning_task, max_exp):
             logging.info("Maximum number of expansions reached. Exiting the search.")
             logging.info("Total number of goal states: %d" % goals)
             logging.info("%d Nodes expanded" % node_id)
-            return state_space.convert_to_json()
+            return state_space.finish()
         for operator, successor_state in planning_task.get_successor_states(node.state):
             queue.append(searchspace.make_child_node(node, operator,
                                                      successor_state))
@@ -176,4 +321,62 @@ def full_state_space_search(planning_task, max_exp):
     logging.info("%d Nodes expanded" % node_id)
     logging.info("Total number of goal states: %d" % goals)
 
-    return state_space.convert_to_json()
+    return state_space.finish()
+
+
+def _full_state_space_search_early_dd(planning_task, max_exp, writer=None):
+    """
+    Variant of the full state space search that detects duplicates at
+    generation time.
+
+    A state is assigned its id when it is generated for the first time, which
+    in FIFO order is the same id the standard variant assigns when it pops the
+    state. Stopping once max_exp states have been discovered thus yields
+    exactly the same transitions as popping and expanding max_exp states.
+    """
+    state_space = _create_state_space_info(planning_task, writer)
+
+    goals = 0
+    is_goal = planning_task.goal_reached(planning_task.initial_state)
+    state_space.add_state(planning_task.initial_state, None, is_goal)
+    if is_goal:
+        goals += 1
+        logging.info("Goal found after %d expansions. Number of goal states found: %d" % (1, goals))
+
+    # fifo-queue storing the ids of the states which are next to explore.
+    # Each state is enqueued only once, when it is first generated.
+    queue = deque()
+    if max_exp > 1:
+        queue.append(0)
+
+    iteration = 0
+    while queue:
+        iteration += 1
+        logging.debug("breadth_first_search: Iteration %d, #unexplored=%d"
+                      % (iteration, len(queue)))
+        parent_id = queue.popleft()
+        state = state_space.get_state_from_id(parent_id)
+        for operator, successor_state in planning_task.get_successor_states(state):
+            successor_id = state_space.find_id(successor_state)
+            if successor_id is not None:
+                state_space.add_transition(parent_id, successor_state, state_space.is_goal[successor_id])
+                continue
+
+            is_goal = planning_task.goal_reached(successor_state)
+            successor_id = state_space.add_transition(parent_id, successor_state, is_goal)
+            queue.append(successor_id)
+            if is_goal:
+                goals += 1
+                logging.info("Goal found after %d expansions. Number of goal states found: %d"
+                             % (successor_id + 1, goals))
+            if successor_id + 1 >= max_exp:
+                logging.info("Maximum number of expansions reached. Exiting the search.")
+                logging.info("Total number of goal states: %d" % goals)
+                logging.info("%d Nodes expanded" % (successor_id + 1))
+                return state_space.finish()
+
+    logging.info("No operators left.")
+    logging.info("%d Nodes expanded" % len(state_space.states))
+    logging.info("Total number of goal states: %d" % goals)
+
+    return state_space.finish()
@@ -0,0 +1,73 @@
+#
+# This file is part of pyperplan.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+In-process API to sample the state space of several instances of a domain
+with the full state space search, without going through the command line.
+"""
+
+import logging
+import math
+
+from pddl.parser import Parser
+import grounding
+from search import full_state_space_search, BinaryStateSpaceWriter
+from task import BitsetTask
+
+
+class StateSpaceSampler:
+    """
+    Samples the state space of instances of one domain. The domain file is
+    parsed only once, when the sampler is created, and reused for all
+    instances. Unless bitset_states is False, the search runs on a
+    task.BitsetTask.
+    """
+    def __init__(self, domain_file, bitset_states=True):
+        self.domain_file = domain_file
+        self.bitset_states = bitset_states
+        logging.info('Parsing Domain {0}'.format(domain_file))
+        self.domain = Parser(domain_file).parse_domain()
+
+    def ground(self, problem_file):
+        """ Parse the given problem file and return the grounded task """
+        logging.info('Parsing Problem {0}'.format(problem_file))
+        problem = Parser(self.domain_file, problem_file).parse_problem(self.domain)
+        logging.info('Grounding start: {0}'.format(problem.name))
+        task = grounding.ground(problem)
+        logging.info('Grounding end: {0}'.format(problem.name))
+        return task
+
+    def sample(self, problem_file, max_nodes=math.inf, early_duplicate_detection=True, writer=None):
+        """
+        Run the full state space search on the given instance.
+
+        @return: the state space as the list of entries returned by
+                 StateSpaceInfo.convert_to_json, or None if it was streamed
+                 to the given writer.
+        """
+        task = self.ground(problem_file)
+        if self.bitset_states:
+            task = BitsetTask(task)
+        return full_state_space_search(task, max_nodes, early_duplicate_detection, writer)
+
+    def sample_to_file(self, problem_file, filename, max_nodes=math.inf, static_atoms=(),
+                       early_duplicate_detection=True):
+        """ Sample the state space of the given instance into a binary state space file """
+        logging.info("Writing state space on '{0}'.".format(filename))
+        with open(filename, 'wb') as file:
+            writer = BinaryStateSpaceWriter(file, static_atoms)
+            self.sample(problem_file, max_nodes, early_duplicate_detection, writer)
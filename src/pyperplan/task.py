@@ -19,6 +19,8 @@
 Classes for representing a STRIPS planning task
 """
 
+from collections import Counter
+
 
 class Operator:
     """
@@ -78,19 +80,24 @@ class Task:
     """
     A STRIPS planning task
     """
-    def __init__(self, name, facts, initial_state, goals, operators):
+    def __init__(self, name, facts, initial_state, goals, operators,
+                 successor_generator=None):
         """
         @param name The task's name
         @param facts A set of all the fact names that are valid in the domain
         @param initial_state A set of fact names that are true at the beginning
         @param goals A set of fact names that must be true to solve the problem
         @param operators A set of operator instances for the domain
+        @param successor_generator An optional SuccessorGenerator for the
+                                   operators. Without it, all operators are
+                                   tested in every state.
         """
         self.name = name
         self.facts = facts
         self.initial_state = initial_state
         self.goals = goals
         self.operators = operators
+        self.successor_generator = successor_generator
 
     def goal_reached(self, state):
         """
@@ -107,9 +114,18 @@ class Task:
         operator and "new_state" the state that results when "op" is applied
         in state "state".
         """
+        if self.successor_generator is not None:
+            return [(op, op.apply(state)) for op in
+                    self.successor_generator.get_applicable_operators(state)]
         return [(op, op.apply(state)) for op in self.operators
                 if op.applicable(state)]
 
+    def facts_of(self, state):
+        """
+        @return The set of facts that are true in state "state".
+        """
+        return state
+
     def __str__(self):
         s = 'Task {0}\n  Vars:  {1}\n  Init:  {2}\n  Goals: {3}\n  Ops:   {4}'
         return s.format(self.name, ', '.join(self.facts),
@@ -119,3 +135,191 @@ class Task:
     def __repr__(self):
         string = '<Task {0}, vars: {1}, operators: {2}>'
         return string.format(self.name, len(self.facts), len(self.operators))
+
+
+class BitsetOperator(Operator):
+    """
+    An operator of a BitsetTask. Besides the sets of facts of a regular
+    Operator, it stores its preconditions and effects as bit masks over the
+    fact indices of the task, so that it can be applied to states that are
+    represented as Python ints.
+    """
+    def __init__(self, operator, fact_index):
+        Operator.__init__(self, operator.name, operator.preconditions,
+                          operator.add_effects, operator.del_effects)
+        self.precondition_mask = _facts_to_bits(self.preconditions, fact_index)
+        self.add_mask = _facts_to_bits(self.add_effects, fact_index)
+        self.del_mask = _facts_to_bits(self.del_effects, fact_index)
+        # Keeps every fact that is not deleted
+        self.keep_mask = ~self.del_mask
+
+    def applicable(self, state):
+        return state & self.precondition_mask == self.precondition_mask
+
+    def apply(self, state):
+        assert self.applicable(state)
+        return (state & self.keep_mask) | self.add_mask
+
+
+class BitsetTask(Task):
+    """
+    A STRIPS planning task whose states are Python ints: bit i of a state is
+    set iff the i-th fact of the task (in sorted order) is true.
+    Checking preconditions and applying operators are then bit operations.
+
+    Use facts_of to translate a state back into a set of facts, and wrap
+    heuristics written for regular tasks with StateDecodingHeuristic.
+    """
+    def __init__(self, task):
+        """
+        @param task The task.Task instance to be represented
+        """
+        self.fact_list = sorted(task.facts)
+        self.fact_index = {fact: i for i, fact in enumerate(self.fact_list)}
+        operators = [BitsetOperator(op, self.fact_index) for op in task.operators]
+        Task.__init__(self, task.name, task.facts,
+                      _facts_to_bits(task.initial_state, self.fact_index),
+                      task.goals, operators,
+                      BitsetSuccessorGenerator(operators, self.fact_index))
+        self.goal_mask = _facts_to_bits(task.goals, self.fact_index)
+
+    def goal_reached(self, state):
+        return state & self.goal_mask == self.goal_mask
+
+    def get_successor_states(self, state):
+        return [(op, (state & op.keep_mask) | op.add_mask) for op in
+                self.successor_generator.get_applicable_operators(state)]
+
+    def facts_of(self, state):
+        facts = []
+        while state:
+            lowest = state & -state
+            facts.append(self.fact_list[lowest.bit_length() - 1])
+            state ^= lowest
+        return frozenset(facts)
+
+    def __str__(self):
+        s = 'Task {0}\n  Vars:  {1}\n  Init:  {2}\n  Goals: {3}\n  Ops:   {4}'
+        return s.format(self.name, ', '.join(self.facts),
+                        self.facts_of(self.initial_state), self.goals,
+                        '\n'.join(map(repr, self.operators)))
+
+
+class SuccessorGenerator:
+    """
+    Decision tree over the preconditions of the operators, similar to the
+    successor generator of Fast Downward. It is a trie in which every
+    operator is stored under the list of its preconditions, so finding the
+    operators applicable in a state only visits the branches whose facts are
+    true in it, instead of testing every operator.
+
+    The preconditions are ordered by the number of operators that share
+    them, which keeps the tree small: e.g. all the operators that require
+    the agent to be at a given location end up below a single node.
+    """
+    def __init__(self, operators):
+        """
+        @param operators The list of operators of the task. Applicable
+                         operators are always returned in this order.
+        """
+        self.operators = list(operators)
+        frequency = Counter(fact for op in self.operators
+                            for fact in op.preconditions)
+        root = ([], dict())
+        for index, op in enumerate(self.operators):
+            node = root
+            for fact in sorted(op.preconditions,
+                               key=lambda fact: (-frequency[fact], fact)):
+                node = node[1].setdefault(fact, ([], dict()))
+            node[0].append(index)
+        self.root = self._freeze(root)
+
+    def _freeze(self, node):
+        """
+        Turn a (operator indices, {fact: child}) node of the tree under
+        construction into the representation used in
+        get_applicable_operators.
+        """
+        indices, children = node
+        children = {fact: self._freeze(child)
+                    for fact, child in children.items()}
+        return tuple(indices), frozenset(children), children
+
+    def get_applicable_operators(self, state):
+        """
+        @return The list of operators that are applicable in "state", in the
+                order in which they appear in the task.
+        """
+        indices = []
+        stack = [self.root]
+        while stack:
+            node_indices, facts, children = stack.pop()
+            indices.extend(node_indices)
+            for fact in facts & state:
+                stack.append(children[fact])
+        indices.sort()
+        return [self.operators[i] for i in indices]
+
+
+class BitsetSuccessorGenerator(SuccessorGenerator):
+    """
+    SuccessorGenerator for the int states of a BitsetTask: the facts that
+    are tested in each node of the tree are a bit mask, and the children
+    are indexed by the bit of their fact.
+    """
+    def __init__(self, operators, fact_index):
+        self.fact_index = fact_index
+        SuccessorGenerator.__init__(self, operators)
+
+    def _freeze(self, node):
+        indices, children = node
+        children = {1 << self.fact_index[fact]: self._freeze(child)
+                    for fact, child in children.items()}
+        return tuple(indices), sum(children), children
+
+    def get_applicable_operators(self, state):
+        indices = []
+        stack = [self.root]
+        while stack:
+            node_indices, mask, children = stack.pop()
+            indices.extend(node_indices)
+            bits = state & mask
+            while bits:
+                lowest = bits & -bits
+                stack.append(children[lowest])
+                bits ^= lowest
+        indices.sort()
+        return [self.operators[i] for i in indices]
+
+
+class StateDecodingHeuristic:
+    """
+    Wraps a heuristic for regular tasks so that it can be used on the search
+    nodes of a BitsetTask: the state of the node is translated back into a
+    set of facts while the heuristic is being computed. The node itself is
+    passed on, since some heuristics store information in the search nodes.
+    """
+    def __init__(self, heuristic, task):
+        self.heuristic = heuristic
+        self.task = task
+
+    def _evaluate(self, function, node):
+        state = node.state
+        node.state = self.task.facts_of(state)
+        try:
+            return function(node)
+        finally:
+            node.state = state
+
+    def __call__(self, node):
+        return self._evaluate(self.heuristic, node)
+
+    def calc_h_with_plan(self, node):
+        return self._evaluate(self.heuristic.calc_h_with_plan, node)
+
+
+def _facts_to_bits(facts, fact_index):
+    bits = 0
+    for fact in facts:
+        bits |= 1 << fact_index[fact]
+    return bits
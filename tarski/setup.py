@@ -14,6 +14,7 @@ def main():
     extras_require = {
         'dev': ['pytest', 'tox'],
         'test': ['pytest', 'tox'],
+        'arrays': ['numpy'],
     }
 
     install_requires = [
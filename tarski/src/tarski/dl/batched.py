@@ -0,0 +1,243 @@
+"""
+ Evaluation of DL concepts, roles and features over a whole batch of states at once, with NumPy.
+
+ The denotation of a concept over the batch is a boolean matrix with one row per state and one column per object,
+ and the denotation of a role is a sparse set of (state, object, object) triples, encoded as a sorted array of
+ integer codes. All constructors are then evaluated with vectorized operations over all states: And, Or and Not
+ are elementwise operations, Exists, Forall and Restrict index the concept matrix with the triples of the role, and
+ compositions and closures of roles are batched boolean matrix products.
+ NumPy is not a requirement of tarski, so this module is not imported from tarski.dl.
+"""
+import numpy as np
+
+from .concepts import UniversalConcept, EmptyConcept, NominalConcept, PrimitiveConcept, NotConcept, AndConcept, \
+    OrConcept, ExistsConcept, ForallConcept, EqualConcept, PrimitiveRole, InverseRole, StarRole, CompositionRole, \
+    RestrictRole, Concept
+from .features import ConceptCardinalityFeature, EmpiricalBinaryConcept, MinDistanceFeature, NullaryAtomFeature
+from ..utils.algorithms import compute_min_distance
+
+
+# Compositions and closures of roles are computed on dense boolean tensors over chunks of states with at most this
+# many (state, object, object) entries, unless the tensor of a single state is already larger
+DENSE_ROLE_LIMIT = 2 ** 24
+
+
+class BatchedDenotations:
+    """ The denotations of concepts, roles and features over the given per-state models, which must all belong to
+    the same instance, i.e. have the same universe. The models only need to provide the primitive denotations of
+    each state, as sets of objects or of pairs of objects. Denotations are cached, so that the denotation of each
+    subterm is computed once per batch. """
+    def __init__(self, models):
+        self.models = list(models)
+        self.objects = list(self.models[0].universe()) if self.models else []
+        self.index = {o: i for i, o in enumerate(self.objects)}
+        self.num_states = len(self.models)
+        self.num_objects = len(self.objects)
+        self.cache = dict()
+
+    def denotation(self, term):
+        """ Return the denotation of the given concept or role in all states, as a (states x objects) boolean
+        matrix for concepts and as a sorted array of triple codes (see encode_triples) for roles. """
+        denotation = self.cache.get(term)
+        if denotation is None:
+            # Subclasses such as GoalConcept are evaluated as their closest supported base class
+            evaluator = next((_EVALUATORS[t] for t in type(term).__mro__ if t in _EVALUATORS), None)
+            if evaluator is None:
+                raise TypeError('Unsupported term type "{}"'.format(type(term).__name__))
+            denotation = self.cache[term] = evaluator(self, term)
+        return denotation
+
+    def feature_values(self, feature):
+        """ Return an array with the value of the given feature in each state """
+        if isinstance(feature, ConceptCardinalityFeature):
+            return np.count_nonzero(self.denotation(feature.c), axis=1)
+        if isinstance(feature, EmpiricalBinaryConcept):
+            return self.denotation(feature.c).any(axis=1)
+        if isinstance(feature, NullaryAtomFeature):
+            return np.array([bool(m.primitive_denotation(feature.atom)) for m in self.models], dtype=bool)
+        if isinstance(feature, MinDistanceFeature):
+            # The distances are computed state by state, on the batched denotations of the feature components
+            c1, c2 = self.denotation(feature.c1), self.denotation(feature.c2)
+            relations = self.role_pairs(feature.r)
+            return np.array([compute_min_distance(self.objects_in(c1[s]), relations[s], self.objects_in(c2[s]))
+                             for s in range(self.num_states)], dtype=np.int64)
+        raise TypeError('Unsupported feature type "{}"'.format(type(feature).__name__))
+
+    def uncompressed_denotation(self, term, state):
+        """ Return the denotation of the given term in the given state as a set of objects or of pairs of objects,
+        in the same form as the per-state models """
+        denotation = self.denotation(term)
+        if isinstance(term, Concept):
+            return self.objects_in(denotation[state])
+        return self.role_pairs(term)[state]
+
+    def objects_in(self, row):
+        return set(self.objects[i] for i in np.flatnonzero(row))
+
+    def role_pairs(self, role):
+        """ Return, for each state, the set of pairs of objects in the denotation of the given role """
+        states, sources, targets = self.decode_triples(self.denotation(role))
+        pairs = [set() for _ in range(self.num_states)]
+        for s, x, y in zip(states.tolist(), sources.tolist(), targets.tolist()):
+            pairs[s].add((self.objects[x], self.objects[y]))
+        return pairs
+
+    def encode_triples(self, states, sources, targets):
+        """ Return the sorted array of unique codes of the given (state, object, object) index triples """
+        n = self.num_objects
+        return np.unique((states.astype(np.int64) * n + sources) * n + targets)
+
+    def decode_triples(self, codes):
+        """ Return the arrays of state, source and target indices of the given triple codes """
+        n = self.num_objects
+        rest, targets = np.divmod(codes, n)
+        states, sources = np.divmod(rest, n)
+        return states, sources, targets
+
+    def dense_chunks(self):
+        """ Return the ranges of consecutive states in which roles can be processed as dense boolean tensors with at
+        most DENSE_ROLE_LIMIT entries, or None if not even a single state fits within that limit """
+        cells = self.num_objects ** 2
+        if cells > DENSE_ROLE_LIMIT:
+            return None
+        size = DENSE_ROLE_LIMIT // max(cells, 1)
+        return [(start, min(start + size, self.num_states)) for start in range(0, self.num_states, size)]
+
+    def apply_dense(self, operation, *denotations):
+        """ Apply the given operation on (states x objects x objects) boolean tensors to the given role denotations,
+        one chunk of states at a time, and return the codes of the resulting denotation. The triple codes are
+        precisely the positions of the triples in the flattened tensor. """
+        cells = self.num_objects ** 2
+        results = []
+        for start, stop in self.dense_chunks():
+            tensors = []
+            for codes in denotations:
+                lo, hi = np.searchsorted(codes, [start * cells, stop * cells])
+                dense = np.zeros((stop - start) * cells, dtype=bool)
+                dense[codes[lo:hi] - start * cells] = True
+                tensors.append(dense.reshape(stop - start, self.num_objects, self.num_objects))
+            results.append(np.flatnonzero(operation(*tensors)) + start * cells)
+        return np.concatenate(results) if results else np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def dense_product(dense1, dense2):
+        """ Return the boolean product of the per-state matrices of the given tensors """
+        return np.matmul(dense1.astype(np.float32), dense2.astype(np.float32)) > 0
+
+    @staticmethod
+    def dense_closure(dense):
+        """ Return the transitive closure of the per-state matrices of the given tensor. Repeated squaring doubles
+        the length of the paths covered by the closure in each round. """
+        while True:
+            extended = dense | BatchedDenotations.dense_product(dense, dense)
+            if np.array_equal(extended, dense):
+                return dense
+            dense = extended
+
+    def compose(self, codes1, codes2):
+        """ Return the codes of the composition of the two given role denotations. If possible, this is a batched
+        boolean matrix product. Otherwise, the second denotation is sorted by its (state, source) prefix, so the
+        matching triples of all pairs of the first one are found with a single binary search. """
+        if self.dense_chunks() is not None:
+            return self.apply_dense(self.dense_product, codes1, codes2)
+
+        n = self.num_objects
+        states, sources, middles = self.decode_triples(codes1)
+        keys = states * n + middles
+        prefixes = codes2 // n
+        lo = np.searchsorted(prefixes, keys, side='left')
+        counts = np.searchsorted(prefixes, keys, side='right') - lo
+        total = counts.sum()
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        offsets = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        targets = codes2[offsets] % n
+        return self.encode_triples(np.repeat(states, counts), np.repeat(sources, counts), targets)
+
+    def _primitive_concept(self, term):
+        result = np.zeros((self.num_states, self.num_objects), dtype=bool)
+        for s, model in enumerate(self.models):
+            result[s, [self.index[o] for o in model.primitive_denotation(term)]] = True
+        return result
+
+    def _primitive_role(self, term):
+        triples = [(s, self.index[x], self.index[y])
+                   for s, model in enumerate(self.models) for x, y in model.primitive_denotation(term)]
+        states, sources, targets = np.array(triples, dtype=np.int64).reshape(-1, 3).T
+        return self.encode_triples(states, sources, targets)
+
+    def _not(self, term):
+        return ~self.denotation(term.c)
+
+    def _and(self, term):
+        return self.denotation(term.c1) & self.denotation(term.c2)
+
+    def _or(self, term):
+        return self.denotation(term.c1) | self.denotation(term.c2)
+
+    def _exists(self, term):
+        c = self.denotation(term.c)
+        states, sources, targets = self.decode_triples(self.denotation(term.r))
+        selected = c[states, targets]
+        result = np.zeros_like(c)
+        result[states[selected], sources[selected]] = True
+        return result
+
+    def _forall(self, term):
+        c = self.denotation(term.c)
+        states, sources, targets = self.decode_triples(self.denotation(term.r))
+        violated = ~c[states, targets]
+        result = np.ones_like(c)
+        result[states[violated], sources[violated]] = False
+        return result
+
+    def _equal(self, term):
+        # x is excluded iff some successor of x is in the denotation of only one of the roles
+        differences = np.setxor1d(self.denotation(term.r1), self.denotation(term.r2), assume_unique=True)
+        states, sources, _ = self.decode_triples(differences)
+        result = np.ones((self.num_states, self.num_objects), dtype=bool)
+        result[states, sources] = False
+        return result
+
+    def _inverse(self, term):
+        states, sources, targets = self.decode_triples(self.denotation(term.r))
+        return self.encode_triples(states, targets, sources)
+
+    def _star(self, term):
+        r = self.denotation(term.r)
+        if self.dense_chunks() is not None:
+            return self.apply_dense(self.dense_closure, r)
+
+        # Semi-naive evaluation: only the pairs found in the last round are extended with another step
+        closure = delta = r
+        while delta.size:
+            delta = np.setdiff1d(self.compose(delta, r), closure, assume_unique=True)
+            closure = np.union1d(closure, delta)
+        return closure
+
+    def _composition(self, term):
+        return self.compose(self.denotation(term.r1), self.denotation(term.r2))
+
+    def _restrict(self, term):
+        r = self.denotation(term.r)
+        states, _, targets = self.decode_triples(r)
+        return r[self.denotation(term.c)[states, targets]]
+
+
+_EVALUATORS = {
+    UniversalConcept: BatchedDenotations._primitive_concept,
+    EmptyConcept: BatchedDenotations._primitive_concept,
+    NominalConcept: BatchedDenotations._primitive_concept,
+    PrimitiveConcept: BatchedDenotations._primitive_concept,
+    NotConcept: BatchedDenotations._not,
+    AndConcept: BatchedDenotations._and,
+    OrConcept: BatchedDenotations._or,
+    ExistsConcept: BatchedDenotations._exists,
+    ForallConcept: BatchedDenotations._forall,
+    EqualConcept: BatchedDenotations._equal,
+    PrimitiveRole: BatchedDenotations._primitive_role,
+    InverseRole: BatchedDenotations._inverse,
+    StarRole: BatchedDenotations._star,
+    CompositionRole: BatchedDenotations._composition,
+    RestrictRole: BatchedDenotations._restrict,
+}
@@ -2,7 +2,8 @@
 
 """
 from ..syntax import Predicate, Function, Sort
-from ..utils.algorithms import transitive_closure
+from ..utils.algorithms import transitive_closure, compose_relations, index_objects, objects_to_bitset, \
+    successor_bitsets
 from ..utils.hashing import consistent_hash
 from .errors import ArityDLMismatch
 
@@ -323,13 +324,11 @@ class ForallConcept(Concept):
 
     def denotation(self, model):
         universe = model.universe()
-        ext_c = model.uncompressed_denotation(self.c)
-        ext_r = model.uncompressed_denotation(self.r)
-        result = set()
-        for x in universe:  # TODO COULD BE OPTIMIZED, E.G. IF R HAS EMPTY EXTENSION, ETC.
-            ys = ext_c.union(y for y in universe if (x, y) not in ext_r)
-            if len(universe) == len(ys):  # No need to compare the sets, as objects has max possible length
-                result.add(x)
+        index = index_objects(universe)
+        ext_c = objects_to_bitset(model.uncompressed_denotation(self.c), index)
+        successors = successor_bitsets(model.uncompressed_denotation(self.r), index)
+        # x is in the denotation iff all of its r-successors are in c
+        result = set(x for x in universe if not successors.get(x, 0) & ~ext_c)
         return model.compressed(result, self.ARITY)
 
     def __repr__(self):
@@ -360,14 +359,10 @@ class EqualConcept(Concept):
 
     def denotation(self, model):
         universe = model.universe()
-        ext_r1 = model.uncompressed_denotation(self.r1)
-        ext_r2 = model.uncompressed_denotation(self.r2)
-        result = set()
-        for x in universe:
-            left = set(z for (y, z) in ext_r1 if y == x)
-            right = set(z for (y, z) in ext_r2 if y == x)
-            if left == right:
-                result.add(x)
+        index = index_objects(universe)
+        left = successor_bitsets(model.uncompressed_denotation(self.r1), index)
+        right = successor_bitsets(model.uncompressed_denotation(self.r2), index)
+        result = set(x for x in universe if left.get(x, 0) == right.get(x, 0))
         return model.compressed(result, self.ARITY)
 
     def __repr__(self):
@@ -493,14 +488,7 @@ class CompositionRole(Role):
     def denotation(self, model):
         ext_r1 = model.uncompressed_denotation(self.r1)
         ext_r2 = model.uncompressed_denotation(self.r2)
-        result = set()
-        for a, b in ext_r1:
-            for x, y in ext_r2:
-                if b == x:
-                    result.add((a, y))
-                    break  # i.e. break the inner loop
-        # for (x, u) in ext_r1:
-        #     result.extend((x, z) for (y, z) in ext_r2 if u == y)
+        result = compose_relations(ext_r1, ext_r2)
         return model.compressed(result, self.ARITY)
 
     def __repr__(self):
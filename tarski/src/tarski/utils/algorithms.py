@@ -3,19 +3,148 @@ import sys
 from collections import deque, defaultdict
 
 
+# A relation over n elements with at least n^2 / DENSE_RELATION_FACTOR pairs is dense, and processed with bitsets
+DENSE_RELATION_FACTOR = 32
+
+# Relations over at most SMALL_UNIVERSE_SIZE objects are composed with bitsets
+SMALL_UNIVERSE_SIZE = 64
+
+
 def transitive_closure(elements):
-    closure = set(elements)
-    while True:
-        closure_until_now = closure | set((x, w) for x, y in closure for q, w in closure if q == y)
+    """ Return the transitive closure of the given binary relation, as a set of pairs. Dense relations are closed
+    with bitset operations (see transitive_closure_bitsets), and all others with one search per source element over
+    an index of the relation, which only touches each pair of the closure a constant number of times. """
+    elements = list(elements)
+    adjacencies = defaultdict(set)
+    for x, y in elements:
+        adjacencies[x].add(y)
+    if not adjacencies:
+        return set()
+    # The bitset closure loops over all objects of the relation, not only over its source elements
+    num_pairs = sum(len(successors) for successors in adjacencies.values())
+    if num_pairs * DENSE_RELATION_FACTOR >= len(index_relation_objects(elements)) ** 2:
+        return transitive_closure_bitsets(elements)
+
+    closure = set()
+    for source, successors in adjacencies.items():
+        reached = set(successors)
+        stack = list(successors)
+        while stack:
+            for z in adjacencies.get(stack.pop(), ()):
+                if z not in reached:
+                    reached.add(z)
+                    stack.append(z)
+        closure.update((source, z) for z in reached)
+    return closure
+
+
+def transitive_closure_bitsets(elements):
+    """ Return the transitive closure of the given binary relation, as a set of pairs. The relation is represented
+    as a boolean matrix over the indices of its elements, with one integer bitset per row, and closed with the
+    Floyd-Warshall algorithm, in which adding all paths through some element k to row i is a single bitwise or. """
+    elements = list(elements)
+    index = index_relation_objects(elements)
+    objects = list(index)
 
-        if len(closure_until_now) == len(closure):
-            break
+    rows = [0] * len(objects)
+    for x, y in elements:
+        rows[index[x]] |= 1 << index[y]
 
-        closure = closure_until_now
+    for k, row_k in enumerate(rows):
+        if not row_k:
+            continue  # No paths go through elements without successors
+        bit = 1 << k
+        for i, row_i in enumerate(rows):
+            if row_i & bit:
+                rows[i] = row_i | row_k
 
+    closure = set()
+    for i, row in enumerate(rows):
+        x = objects[i]
+        closure.update((x, objects[j]) for j in bitset_members(row))
     return closure
 
 
+def compose_relations(r1, r2):
+    """ Return the composition of the given binary relations, i.e. the set of pairs (x, z) such that (x, y) is in
+    r1 and (y, z) is in r2 for some y. Dense relations and relations over few objects are composed with bitset
+    operations (see compose_relations_bitsets), and all others with a hash join that indexes r2 by its first
+    element, which takes time linear in the size of the relations and of the result. """
+    r1, r2 = list(r1), list(r2)
+    index = index_relation_objects(r2)
+    if len(index) <= SMALL_UNIVERSE_SIZE or len(r2) * DENSE_RELATION_FACTOR >= len(index) ** 2:
+        return compose_relations_bitsets(r1, r2)
+
+    successors = defaultdict(set)
+    for y, z in r2:
+        successors[y].add(z)
+
+    result = set()
+    for x, y in r1:
+        zs = successors.get(y)
+        if zs:
+            result.update((x, z) for z in zs)
+    return result
+
+
+def compose_relations_bitsets(r1, r2):
+    """ Return the composition of the given binary relations, as a set of pairs. The relations are represented as
+    boolean matrices over the indices of the objects in r2, with one integer bitset per row, so that their boolean
+    product adds all successors through a pair (x, y) of r1 to row x with a single bitwise or. """
+    r2 = list(r2)
+    index = index_relation_objects(r2)
+    objects = list(index)
+
+    successors = successor_bitsets(r2, index)
+    rows = defaultdict(int)
+    for x, y in r1:
+        rows[x] |= successors.get(y, 0)
+
+    result = set()
+    for x, row in rows.items():
+        result.update((x, objects[j]) for j in bitset_members(row))
+    return result
+
+
+def index_objects(objects):
+    """ Return a dictionary mapping each of the given objects to its position in the given iterable """
+    return {o: i for i, o in enumerate(objects)}
+
+
+def index_relation_objects(relation):
+    """ Return a dictionary mapping each object that appears in the given binary relation to a distinct index """
+    index = dict()
+    for x, y in relation:
+        index.setdefault(x, len(index))
+        index.setdefault(y, len(index))
+    return index
+
+
+def successor_bitsets(relation, index):
+    """ Return a dictionary mapping each object x with some pair (x, y) in the given binary relation to the bitset
+    with the indices of all such objects y, according to the given index. """
+    successors = defaultdict(int)
+    for x, y in relation:
+        successors[x] |= 1 << index[y]
+    return successors
+
+
+def objects_to_bitset(objects, index):
+    """ Return the integer bitset with the indices of the given objects, according to the given index """
+    bitset = 0
+    for o in objects:
+        bitset |= 1 << index[o]
+    return bitset
+
+
+def bitset_members(bitset):
+    """ Iterate over the indices of the bits set in the given integer bitset, in increasing order """
+    while bitset:
+        lowest = bitset & -bitset
+        yield lowest.bit_length() - 1
+        bitset ^= lowest
+
+
 def compute_min_distance(c1s, relation, c2s):
     """  """
     # Cover first a couple of base cases to enhance performance
@@ -1,27 +1,58 @@
-
 import hashlib
 import sys
 
+# The size of the hashes, in bytes, which is that of the hashes on the current Python platform
+_DIGEST_SIZE = sys.hash_info.width // 8
+
 
 def int_to_bytes(value):
-    return value.to_bytes((value.bit_length() + 7) // 8, 'big', signed=True) or b'\0'
+    # One extra bit for the sign, as e.g. 128 does not fit in a single signed byte
+    return value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True)
 
 
-def consistent_hash(iterable):
-    h = hashlib.sha256()
-    for elem in iterable:
-        if isinstance(elem, str):
-            h.update(elem.encode())
+def stable_digest(data):
+    """ Return a hash of the given bytes that is the same on every process and run. BLAKE2b computes a digest of the
+    desired size directly, and is faster than SHA-256 on 64-bit platforms. """
+    return int.from_bytes(hashlib.blake2b(data, digest_size=_DIGEST_SIZE).digest(), 'big')
+
+
+# The encodings of the classes hashed so far, as a class appears in the hash of every object of the class
+_class_encodings = dict()
+
+
+def _length_prefixed(tag, data):
+    return tag + len(data).to_bytes(4, 'big') + data
 
-        elif isinstance(elem, int):
-            h.update(int_to_bytes(elem))
 
-        elif isinstance(elem, type):
-            h.update(str(elem).encode())
+def _encode(elem):
+    """ Return an unambiguous encoding of the given element, as a tag followed by a payload """
+    if isinstance(elem, str):
+        return _length_prefixed(b's', elem.encode())
 
-        elif hasattr(elem, "__hash__"):
-            h.update(int_to_bytes(object.__hash__(elem)))
+    if isinstance(elem, int):
+        return _length_prefixed(b'i', int_to_bytes(elem))
 
-        else:
-            h.update(str(elem).encode())
-    return int(h.hexdigest(), base=16) & (2**sys.hash_info.width - 1)
+    if isinstance(elem, type):
+        encoding = _class_encodings.get(elem)
+        if encoding is None:
+            name = '{}.{}'.format(elem.__module__, elem.__qualname__)
+            encoding = _class_encodings[elem] = _length_prefixed(b't', name.encode())
+        return encoding
+
+    if isinstance(elem, tuple):
+        return b'n' + consistent_hash(elem).to_bytes(_DIGEST_SIZE, 'big')
+
+    structural_hash = getattr(elem, "hash", None)
+    if isinstance(structural_hash, int):
+        # Objects such as DL concepts and roles store their own structural hash
+        return _length_prefixed(b'h', int_to_bytes(structural_hash))
+
+    return _length_prefixed(b'r', str(elem).encode())
+
+
+def consistent_hash(iterable):
+    """ Return a structural hash of the given sequence of elements, which is the same on every process and run.
+    Strings, integers and classes are hashed by value, tuples recursively, and objects with a "hash" attribute,
+    such as DL concepts and roles, through that hash, so that a hash computed bottom-up from the constructor type,
+    predicate symbols and child hashes of a concept only depends on the structure of the concept. """
+    return stable_digest(b''.join(map(_encode, iterable)))
@@ -0,0 +1,81 @@
+"""
+ Tests for the batched evaluation of DL concepts and features over several states
+"""
+import random
+
+import pytest
+from tarski.dl import PrimitiveRole, PrimitiveConcept, NominalConcept, StarRole, InverseRole, NotConcept, \
+    AndConcept, OrConcept, ExistsConcept, ForallConcept, EqualConcept, CompositionRole, RestrictRole, \
+    UniversalConcept, GoalConcept, ConceptCardinalityFeature, EmpiricalBinaryConcept, MinDistanceFeature
+
+from .test_concepts import SetDenotationModel, get_bw_language
+
+np = pytest.importorskip("numpy")
+from tarski.dl.batched import BatchedDenotations  # noqa: E402
+
+
+def generate_random_models(language, num_states, seed):
+    rng = random.Random(seed)
+    objects = [c.symbol for c in language.constants()]
+    models = []
+    for _ in range(num_states):
+        on = set((x, y) for x in objects for y in objects if rng.random() < 0.3)
+        unary = {p: set(o for o in objects if rng.random() < 0.5) for p in ("clear", "ontable", "holding")}
+        models.append(SetDenotationModel(objects, dict(on=on, **unary)))
+    return models
+
+
+def generate_terms(language):
+    object_t = language.get_sort("object")
+    on = PrimitiveRole(language.get_predicate("on"))
+    clear, ontable = (PrimitiveConcept(language.get_predicate(p)) for p in ("clear", "ontable"))
+    b1 = NominalConcept("b1", object_t)
+    above, below = StarRole(on), StarRole(InverseRole(on))
+    return [
+        NotConcept(clear, object_t),
+        AndConcept(clear, ontable, "object"),
+        OrConcept(b1, ontable, "object"),
+        ExistsConcept(on, clear),
+        ExistsConcept(above, b1),
+        ForallConcept(on, clear),
+        ForallConcept(below, NotConcept(b1, object_t)),
+        EqualConcept(on, above, "object"),
+        EqualConcept(InverseRole(on), below, "object"),
+        above,
+        CompositionRole(on, InverseRole(on)),
+        CompositionRole(above, RestrictRole(on, ontable)),
+        RestrictRole(below, clear),
+    ]
+
+
+@pytest.mark.parametrize("dense_role_limit", [0, 16 * 7, 2 ** 24])
+def test_batched_denotations_match_per_state_denotations(monkeypatch, dense_role_limit):
+    # Roles are processed as sparse triples, as dense tensors of 7 states, and as a single dense tensor
+    monkeypatch.setattr("tarski.dl.batched.DENSE_ROLE_LIMIT", dense_role_limit)
+    language, _ = get_bw_language()
+    models = generate_random_models(language, 30, seed=0)
+    batch = BatchedDenotations(models)
+
+    for term in generate_terms(language):
+        for s, model in enumerate(models):
+            assert batch.uncompressed_denotation(term, s) == term.denotation(model), (term, s)
+
+
+def test_batched_feature_values():
+    language, _ = get_bw_language()
+    models = generate_random_models(language, 30, seed=1)
+    batch = BatchedDenotations(models)
+    on = PrimitiveRole(language.get_predicate("on"))
+    clear = PrimitiveConcept(language.get_predicate("clear"))
+    holding = GoalConcept(language.get_predicate("holding"))
+
+    card = ConceptCardinalityFeature(ExistsConcept(on, clear))
+    assert batch.feature_values(card).tolist() == [len(card.c.denotation(m)) for m in models]
+
+    binary = EmpiricalBinaryConcept(ConceptCardinalityFeature(holding))
+    assert batch.feature_values(binary).tolist() == [bool(m.primitive_denotations["holding"]) for m in models]
+
+    assert batch.feature_values(ConceptCardinalityFeature(UniversalConcept("object"))).tolist() == [4] * len(models)
+
+    distance = MinDistanceFeature(clear, on, holding)
+    assert batch.feature_values(distance).tolist() == [distance.denotation(m) for m in models]
@@ -3,7 +3,7 @@
 """
 import pytest
 from tarski.dl import SyntacticFactory, PrimitiveRole, PrimitiveConcept, NominalConcept, StarRole, InverseRole, \
-    ArityDLMismatch
+    ArityDLMismatch, ForallConcept, EqualConcept, CompositionRole, UniversalConcept
 from ..common import blocksworld
 
 
@@ -48,6 +48,77 @@ def test_basic_concept_creation():
     _ = factory.create_and_concept(c1, c2)
 
 
+class ObjectSet(set):
+    """ A set of objects that can be complemented with respect to some universe """
+    def __init__(self, objects, universe):
+        super().__init__(objects)
+        self.universe = universe
+
+    def __invert__(self):
+        return ObjectSet(self.universe - self, self.universe)
+
+
+class SetDenotationModel:
+    """ A minimal model that represents all denotations as plain, uncompressed sets """
+    def __init__(self, objects, primitive_denotations):
+        self.objects = set(objects)
+        self.primitive_denotations = primitive_denotations
+
+    def universe(self):
+        return self.objects
+
+    def primitive_denotation(self, term):
+        if isinstance(term, UniversalConcept):
+            return self.objects
+        if isinstance(term, NominalConcept):
+            return {term.name}
+        return self.primitive_denotations[term.name]
+
+    def compressed(self, denotation, arity):
+        return set(denotation)
+
+    def uncompressed_denotation(self, term):
+        return term.denotation(self)
+
+    def compressed_denotation(self, term):
+        return ObjectSet(term.denotation(self), self.objects)
+
+
+def get_bw_model(language):
+    # b1 is on b2, which is on b3; b4 is on the table
+    on = {("b1", "b2"), ("b2", "b3")}
+    return SetDenotationModel(
+        [c.symbol for c in language.constants()],
+        dict(on=on, clear={"b1", "b4"}, ontable={"b3", "b4"}, holding=set()))
+
+
+def test_forall_and_equal_denotations():
+    language, _ = get_bw_language()
+    model = get_bw_model(language)
+    on_r = PrimitiveRole(language.get_predicate("on"))
+    above = StarRole(on_r)
+    clear_c = PrimitiveConcept(language.get_predicate("clear"))
+    ontable_c = PrimitiveConcept(language.get_predicate("ontable"))
+
+    # Objects without successors satisfy any universal restriction
+    assert ForallConcept(on_r, ontable_c).denotation(model) == {"b2", "b3", "b4"}
+    assert ForallConcept(above, ontable_c).denotation(model) == {"b2", "b3", "b4"}
+    assert ForallConcept(on_r, clear_c).denotation(model) == {"b3", "b4"}
+
+    assert EqualConcept(on_r, on_r, "object").denotation(model) == {"b1", "b2", "b3", "b4"}
+    assert EqualConcept(on_r, above, "object").denotation(model) == {"b2", "b3", "b4"}
+    assert EqualConcept(on_r, InverseRole(on_r), "object").denotation(model) == {"b4"}
+
+
+def test_composition_denotation():
+    language, _ = get_bw_language()
+    model = get_bw_model(language)
+    on_r = PrimitiveRole(language.get_predicate("on"))
+    assert CompositionRole(on_r, on_r).denotation(model) == {("b1", "b3")}
+    assert CompositionRole(on_r, InverseRole(on_r)).denotation(model) == {("b1", "b1"), ("b2", "b2")}
+    assert CompositionRole(on_r, StarRole(on_r)).denotation(model) == {("b1", "b3")}
+
+
 def get_bw_language():
     language = blocksworld.generate_small_strips_bw_language()
     # model = Model(lang)
@@ -0,0 +1,71 @@
+"""
+ Tests for the graph algorithms in tarski.utils.algorithms
+"""
+import random
+
+import pytest
+from tarski.utils import algorithms
+from tarski.utils.algorithms import transitive_closure, transitive_closure_bitsets, compose_relations, \
+    compose_relations_bitsets
+
+
+def naive_transitive_closure(elements):
+    closure = set(elements)
+    while True:
+        extended = closure | set((x, w) for x, y in closure for q, w in closure if q == y)
+        if len(extended) == len(closure):
+            return closure
+        closure = extended
+
+
+@pytest.mark.parametrize("closure", [transitive_closure, transitive_closure_bitsets])
+def test_transitive_closure_base_cases(closure):
+    assert closure([]) == set()
+    assert closure([(1, 1)]) == {(1, 1)}
+    assert closure([(1, 2), (2, 3), (3, 4)]) == {(1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4)}
+
+    # The closure is not reflexive: only elements on a cycle are related to themselves
+    assert closure([(1, 2), (2, 1), (2, 3)]) == {(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3)}
+
+
+@pytest.mark.parametrize("closure", [transitive_closure, transitive_closure_bitsets])
+def test_transitive_closure_matches_naive_closure(closure):
+    rng = random.Random(0)
+    for num_pairs in (5, 20, 60, 150):
+        relation = set((rng.randrange(15), rng.randrange(15)) for _ in range(num_pairs))
+        assert closure(relation) == naive_transitive_closure(relation)
+        # Arbitrary iterables are accepted
+        assert closure(iter(relation)) == naive_transitive_closure(relation)
+
+
+def test_transitive_closure_of_fan_out_relations(monkeypatch):
+    # Few sources with many targets are sparse over all the objects of the relation, so they are not closed with
+    # bitsets, which would loop over every target
+    relation = [(x, y) for x in (0, 1) for y in range(2, 5002)] + [(0, 1)]
+    expected = set(relation)
+    assert transitive_closure_bitsets(relation) == expected
+    monkeypatch.setattr(algorithms, "transitive_closure_bitsets", None)
+    assert transitive_closure(relation) == expected
+
+
+@pytest.mark.parametrize("compose", [compose_relations, compose_relations_bitsets])
+def test_relation_composition(compose):
+    assert compose([], [(1, 2)]) == set()
+    assert compose([(1, 2)], []) == set()
+
+    # All the pairs of r2 that follow some pair of r1 need to be composed, not only the first one
+    assert compose([(1, 2), (3, 2)], [(2, 4), (2, 5), (6, 7)]) == {(1, 4), (1, 5), (3, 4), (3, 5)}
+
+    rng = random.Random(0)
+    for num_pairs in (5, 20, 60, 150):
+        r1 = set((rng.randrange(15), rng.randrange(15)) for _ in range(num_pairs))
+        r2 = set((rng.randrange(15), rng.randrange(15)) for _ in range(num_pairs))
+        assert compose(iter(r1), iter(r2)) == set((x, z) for x, y in r1 for q, z in r2 if q == y)
+
+
+def test_relation_composition_over_large_universes():
+    # Sparse relations over many objects are composed with the hash join
+    r1 = [(i, i + 1) for i in range(0, 1000, 2)]
+    r2 = [(i, i * 2) for i in range(1, 1000, 2)] + [(i, -i) for i in range(1, 1000, 2)]
+    expected = set((i, (i + 1) * 2) for i in range(0, 1000, 2)) | set((i, -i - 1) for i in range(0, 1000, 2))
+    assert compose_relations(r1, r2) == expected == compose_relations_bitsets(r1, r2)
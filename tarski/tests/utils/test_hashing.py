@@ -0,0 +1,45 @@
+"""
+ Tests for the structural hashing of DL terms
+"""
+import os
+import subprocess
+import sys
+
+from tarski.dl import PrimitiveRole, PrimitiveConcept, StarRole, AndConcept, OrConcept, ExistsConcept
+from tarski.utils.hashing import consistent_hash
+
+from ..common import blocksworld
+
+
+def create_concepts():
+    language = blocksworld.generate_small_strips_bw_language()
+    on = PrimitiveRole(language.get_predicate("on"))
+    clear = PrimitiveConcept(language.get_predicate("clear"))
+    ontable = PrimitiveConcept(language.get_predicate("ontable"))
+    return [ExistsConcept(StarRole(on), clear), AndConcept(clear, ontable, "object"),
+            OrConcept(clear, ontable, "object"), AndConcept(ontable, clear, "object")]
+
+
+def test_structurally_equal_concepts_have_equal_hashes():
+    first, second = create_concepts(), create_concepts()
+    for c1, c2 in zip(first, second):
+        assert c1 is not c2
+        assert hash(c1) == hash(c2) and c1 == c2
+
+    assert len(set(hash(c) for c in first)) == len(first)
+
+
+def test_hashes_do_not_depend_on_the_process():
+    code = "from tests.utils.test_hashing import create_concepts; print([c.hash for c in create_concepts()])"
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONHASHSEED="123")
+    env["PYTHONPATH"] = os.pathsep.join([os.path.join(root, "src"), root, env.get("PYTHONPATH", "")])
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=root, env=env)
+    assert output.decode().strip() == str([c.hash for c in create_concepts()])
+
+
+def test_hashed_elements_are_not_ambiguous():
+    assert consistent_hash(("ab", "c")) != consistent_hash(("a", "bc"))
+    assert consistent_hash(("1",)) != consistent_hash((1,))
+    assert consistent_hash(((1, 2), 3)) != consistent_hash((1, (2, 3)))
+    assert consistent_hash((1, 2)) == consistent_hash([1, 2])